@@ -0,0 +1,60 @@
+"""
+Checks the streaming main text BioC XML writer against the bioc package's own encoder (loading the BioC JSON output
+and dumping it as BioC XML) for a directory of HTML articles, and reports the time taken by each.
+
+Usage (from the repository root):
+    python Tests/BioCXML/BioCXMLEquivalence.py -f path/to/html/files [-c configs/config_pmc.json]
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path[:0] = [repo_root, os.path.join(repo_root, "src")]
+os.chdir(repo_root)
+
+from bioc import loads, dumps, BioCFileType
+
+from src.AutoCorpus import AutoCorpus, read_config
+from src.bioc_formatter import BiocFormatter
+from src.utils import CompiledConfig
+
+
+def bioc_package_xml(ac):
+    return dumps(loads(BiocFormatter(ac).to_json(2), BioCFileType.BIOC_JSON), BioCFileType.BIOC_XML)
+
+
+def streamed_xml(ac):
+    out = io.BytesIO()
+    ac.write_main_text_bioc_xml(out)
+    return out.getvalue().decode("utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--filepath", type=str, required=True, help="directory of HTML articles")
+    parser.add_argument("-c", "--config", type=str, default="configs/config_pmc.json", help="config file to use")
+    args = parser.parse_args()
+    config = CompiledConfig(read_config(args.config))
+    html_files = sorted(x for x in glob.iglob(os.path.join(os.path.abspath(args.filepath), "**", "*.html"),
+                                              recursive=True) if "_table_" not in os.path.basename(x))
+    timings = {"bioc package": 0.0, "streamed": 0.0}
+    differing = []
+    for html_file in html_files:
+        ac = AutoCorpus(config, main_text=html_file)
+        start = time.perf_counter()
+        expected = bioc_package_xml(ac)
+        timings["bioc package"] += time.perf_counter() - start
+        start = time.perf_counter()
+        result = streamed_xml(ac)
+        timings["streamed"] += time.perf_counter() - start
+        if result != expected:
+            differing.append(html_file)
+    print(F"{len(html_files) - len(differing)}/{len(html_files)} identical")
+    for html_file in differing:
+        print(F"- {html_file}")
+    for name, seconds in timings.items():
+        print(F"{name}: {seconds:.3f}s")
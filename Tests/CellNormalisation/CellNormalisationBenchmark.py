@@ -0,0 +1,84 @@
+"""
+Checks table cell normalisation against the p-value and cleaning cases it is expected to handle, then times it
+against the previous per-cell implementation (string concatenation and re-parsed patterns).
+
+Usage (from the repository root):
+    python Tests/CellNormalisation/CellNormalisationBenchmark.py [-n repeats]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path[:0] = [repo_root, os.path.join(repo_root, "src")]
+
+from bs4 import BeautifulSoup
+
+from src.cell_normalisation import normalise_cell, PVAL_REGEX, PVAL_SCIENTIFIC_REGEX
+from src.utils import navigate_contents
+
+# cell HTML and the normalised text expected for it
+cases = [
+    ("5 x 10-7", "5e-7"),
+    ("4.1X10-5", "4.1e-5"),
+    ("2.0*10_-9", "2.0e-9"),
+    ("3.4E-5", "3.4e-5"),
+    ("2.5 e − 3", "2.5e-3"),
+    ("7.1e−11", "7.1e-11"),
+    ("1.0 E-4", "1.0e-4"),
+    ("(2.1)", "2.1"),
+    # superscript exponents and a space before the minus sign are not rewritten
+    ("1.2 × 10<sup>−8</sup>", "1.2 × 10<sup>−8</sup>"),
+    ("(3.2 × 10<sup>−6</sup>)", "3.2 × 10<sup>−6</sup>"),
+    ("6.5 ×10 −3", "6.5 ×10 −3"),
+    ("1,03", "1,03"),
+    ("0.9 (0.8–1.1)", "0.9 (0.8–1.1)"),
+    ("NA", "NA"),
+    ("-", "-"),
+    ("rs1000", "rs1000"),
+    ("GENE0 <span>x</span>", "GENE0 x"),
+    ("<em>ABC</em><sub>2</sub>", "ABC<sub>2</sub>"),
+    ("p&#x000a0;value", "p value"),
+    ("<b>12.5</b>\n ± 3", "12.5  ± 3"),
+]
+
+
+def previous_normalise_cell(cell):
+    value = ""
+    for item in cell.contents:
+        value += navigate_contents(item)
+    value = value.strip().replace('\u2009', ' ').replace("&#x000a0;", " ")
+    value = re.sub(r"\s", " ", value)
+    value = re.sub(r"</?span[^>\n]*>?|<hr/>?", "", value)
+    value = re.sub(r"\n", "", value)
+    if value.startswith('(') and value.endswith(')'):
+        value = value[1:-1]
+    if re.match(PVAL_REGEX, value):
+        value = re.sub(r'(\s?)[*×xX](\s?)10(_?)', 'e', value).replace('−', '-')
+    if re.match(PVAL_SCIENTIFIC_REGEX, value):
+        value = re.sub(r'(\s?)[–−-](\s?)', '-', value)
+        value = re.sub(r'(\s?)[eE]', 'e', value)
+    return value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeats", type=int, default=2000, help="passes over the cases per timing")
+    args = parser.parse_args()
+    soup = BeautifulSoup("<table><tr>" + "".join(F"<td>{x}</td>" for x, _ in cases) + "</tr></table>", "html.parser")
+    cells = soup.find_all("td")
+
+    failures = 0
+    for cell, (html, expected) in zip(cells, cases):
+        for implementation in [normalise_cell, previous_normalise_cell]:
+            result = implementation(cell)
+            if result != expected:
+                failures += 1
+                print(F"{implementation.__name__}({html!r}) returned {result!r}, expected {expected!r}")
+
+    for implementation in [previous_normalise_cell, normalise_cell]:
+        seconds = min(timeit.repeat(lambda: [implementation(x) for x in cells], number=args.repeats, repeat=3))
+        print(F"{implementation.__name__}: {seconds / (args.repeats * len(cells)) * 1e6:.2f} µs per cell")
+    sys.exit(1 if failures else 0)
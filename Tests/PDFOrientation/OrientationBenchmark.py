@@ -0,0 +1,136 @@
+"""
+Compares PDF page orientation detection from character geometry (PDFSession.detect_rotation) with the previous
+heuristic of extracting the page text with PyPDF2 at each of the four orientations, on PDFs of rotated landscape
+tables, and reports how often they agree and the time each takes.
+
+Without -f, synthetic PDFs are written to a temporary directory: ruled tables drawn sideways on portrait pages, pages
+with a /Rotate entry, and pages mixing upright paragraphs with a sideways table, whose rows are written either down or
+up the table. Exits with status 1 unless every page agrees.
+
+Usage (from the repository root):
+    python Tests/PDFOrientation/OrientationBenchmark.py [-f path/to/pdf/files] [-p pages]
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import tempfile
+import time
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path[:0] = [repo_root, os.path.join(repo_root, "src")]
+
+import PyPDF2
+
+from src.pdf_extractor import PDFSession
+
+
+def previous_rotation(reader, page_idx):
+    """
+    Orientation heuristic used before PDFSession.detect_rotation, four PyPDF2 text extractions per page.
+    """
+    page = reader.pages[page_idx]
+    rotation_line_length_counts = []
+    for orientation in range(0, 360, 90):
+        page_text = page.extract_text(orientations=orientation).split("\n")
+        rotation_line_length_counts.append(sum(len(s) for s in page_text) / len(page_text) if page_text else 0)
+    if len(set(rotation_line_length_counts)) > 1:
+        return rotation_line_length_counts.index(max(rotation_line_length_counts)) * 90
+    return 0
+
+
+def escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def table_operators(rnd, sideways, rows_upward=False):
+    rows, cols, col_width, row_height = rnd.randint(4, 20), rnd.randint(3, 9), 70, 14
+    operators = ["q"]
+    if sideways:
+        # landscape table on a portrait page, its text reads bottom to top
+        operators.append(F"0 1 -1 0 {rows * row_height + 80} 60 cm")
+    else:
+        operators.append("1 0 0 1 50 80 cm")
+    for r in range(rows + 1):
+        operators.append(F"0 {r * row_height} m {cols * col_width} {r * row_height} l S")
+    for c in range(cols + 1):
+        operators.append(F"{c * col_width} 0 m {c * col_width} {rows * row_height} l S")
+    # rows are mostly drawn from the top of the table down, as typesetting software emits them
+    for r in (range(rows) if rows_upward else reversed(range(rows))):
+        for c in range(cols):
+            text = rnd.choice([str(rnd.randint(0, 999)), F"{rnd.random():.2f}", F"rs{rnd.randint(1, 99999)}", "1.2e-8"])
+            operators.append(F"BT /F1 8 Tf {c * col_width + 3} {r * row_height + 4} Td ({escape(text)}) Tj ET")
+    operators.append("Q")
+    return operators
+
+
+def paragraph_operators(rnd):
+    words = "the genome wide association study of body mass index found loci in a large cohort".split()
+    return [F"BT /F1 10 Tf 50 {760 - i * 13} Td ({' '.join(rnd.choice(words) for _ in range(rnd.randint(6, 14)))}) Tj ET"
+            for i in range(rnd.randint(2, 12))]
+
+
+def write_landscape_pdf(path, seed, pages):
+    rnd = random.Random(seed)
+    objects = {1: "<< /Type /Catalog /Pages 2 0 R >>", 3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for i in range(pages):
+        kind = rnd.choice(["sideways", "rotate_entry", "sideways_rotate_entry", "mixed", "mixed_rows_upward", "upright"])
+        operators = paragraph_operators(rnd) if kind.startswith("mixed") else []
+        operators += table_operators(rnd, kind != "upright" and kind != "rotate_entry", kind == "mixed_rows_upward")
+        stream = "\n".join(operators)
+        rotate = F" /Rotate {rnd.choice([90, 180, 270])}" if "rotate_entry" in kind else ""
+        objects[4 + 2 * i] = F"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"
+        objects[5 + 2 * i] = (F"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                              F"/Contents {4 + 2 * i} 0 R{rotate} >>")
+        kids.append(F"{5 + 2 * i} 0 R")
+    objects[2] = F"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number in sorted(objects):
+        offsets.append(len(output))
+        output += F"{number} 0 obj\n{objects[number]}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += F"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += "".join(F"{x:010d} 00000 n \n" for x in offsets).encode()
+    output += F"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--filepath", type=str, help="directory of PDF files, default synthetic landscape tables")
+    parser.add_argument("-p", "--pages", type=int, default=40, help="pages per synthetic PDF")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.filepath:
+            pdf_files = sorted(glob.glob(os.path.join(args.filepath, "**", "*.pdf"), recursive=True))
+        else:
+            pdf_files = [os.path.join(tmp_dir, F"landscape_{i}.pdf") for i in range(5)]
+            for i, pdf_file in enumerate(pdf_files):
+                write_landscape_pdf(pdf_file, i, args.pages)
+        timings = {"previous": 0.0, "geometry": 0.0}
+        pages, agreed = 0, 0
+        for pdf_file in pdf_files:
+            reader = PyPDF2.PdfReader(pdf_file)
+            with PDFSession(pdf_file) as session:
+                for i, page in enumerate(session.pages):
+                    # both heuristics work from an already parsed file, the page layout is shared with text extraction
+                    page.extract_text()
+                    start = time.perf_counter()
+                    expected = previous_rotation(reader, i)
+                    timings["previous"] += time.perf_counter() - start
+                    start = time.perf_counter()
+                    result = session.get_rotation(i)
+                    timings["geometry"] += time.perf_counter() - start
+                    pages += 1
+                    agreed += expected == result
+                    if expected != result:
+                        print(F"{os.path.basename(pdf_file)} page {i + 1}: previous {expected}, geometry {result}")
+    print(F"{agreed}/{pages} pages agree")
+    for name, seconds in timings.items():
+        print(F"{name}: {seconds:.3f}s ({1000 * seconds / max(pages, 1):.2f} ms per page)")
+    if agreed != pages:
+        sys.exit(1)
@@ -0,0 +1,99 @@
+"""
+Runs Auto-CORPus over a directory of HTML articles once per HTML parser backend and per config in configs/, and
+reports which backends produce BioC output identical to the default html.parser.
+
+Usage (from the repository root):
+    python Tests/ParserEquivalence/ParserEquivalence.py -f path/to/html/files [-o report.md] [-d description]
+
+report.md was produced from the synthetic PMC style articles in samples/:
+    python Tests/ParserEquivalence/ParserEquivalence.py -f Tests/ParserEquivalence/samples \
+        -o Tests/ParserEquivalence/report.md -d "..."
+"""
+import argparse
+import glob
+import os
+import sys
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+working_dir = os.getcwd()
+sys.path[:0] = [repo_root, os.path.join(repo_root, "src")]
+os.chdir(repo_root)
+
+from src.AutoCorpus import AutoCorpus, HTML_PARSERS, read_config
+from src.utils import CompiledConfig
+
+configs = sorted(glob.glob("configs/*.json"))
+outputs = {
+    "bioc": lambda ac: ac.main_text_to_bioc_json(),
+    "bioc_xml": lambda ac: ac.main_text_to_bioc_xml(),
+    "tables": lambda ac: ac.tables_to_bioc_json(),
+    "abbreviations": lambda ac: ac.abbreviations_to_bioc_json()
+}
+
+
+def run_backend(config, html_file, html_parser):
+    try:
+        ac = AutoCorpus(config, main_text=html_file, html_parser=html_parser)
+        return {name: output(ac) for name, output in outputs.items()}
+    except Exception as e:
+        return {"error": F"{type(e).__name__}: {e}"}
+
+
+def compare_backends(html_files, config_path):
+    """
+    Returns a dict of backend to the list of (file, [differing outputs]) pairs which do not match html.parser.
+    """
+    config = CompiledConfig(read_config(config_path))
+    differences = {x: [] for x in HTML_PARSERS if x != "html.parser"}
+    for html_file in html_files:
+        reference = run_backend(config, html_file, "html.parser")
+        for backend in differences:
+            result = run_backend(config, html_file, backend)
+            differing = sorted(x for x in set(reference) | set(result) if reference.get(x) != result.get(x))
+            if differing:
+                differences[backend].append((html_file, differing))
+    return differences
+
+
+def build_report(input_dir, html_files, results, description=None):
+    lines = [
+        "# HTML parser equivalence report",
+        "",
+        F"Input: {input_dir} ({len(html_files)} HTML files)",
+        ""
+    ]
+    if description:
+        lines.extend([description, ""])
+    lines.extend([
+        "| config | " + " | ".join(results[configs[0]].keys()) + " |",
+        "|---" * (len(results[configs[0]]) + 1) + "|"
+    ])
+    for config_path, differences in results.items():
+        cells = [F"{len(html_files) - len(x)}/{len(html_files)} identical" for x in differences.values()]
+        lines.append(F"| {os.path.basename(config_path)} | " + " | ".join(cells) + " |")
+    for config_path, differences in results.items():
+        for backend, files in differences.items():
+            if not files:
+                continue
+            lines.extend(["", F"## {os.path.basename(config_path)} with {backend}", ""])
+            lines.extend([F"- {html_file}: {', '.join(differing)}" for html_file, differing in files])
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--filepath", type=str, required=True, help="directory of HTML articles")
+    parser.add_argument("-o", "--output", type=str, help="file to write the markdown report to, default stdout")
+    parser.add_argument("-d", "--description", type=str, help="description of the input articles for the report")
+    args = parser.parse_args()
+    # paths are resolved before the chdir to the repository root above
+    input_dir = os.path.relpath(os.path.abspath(os.path.join(working_dir, args.filepath)), repo_root)
+    html_files = sorted(x for x in glob.iglob(os.path.join(input_dir, "**", "*.html"), recursive=True)
+                        if "_table_" not in os.path.basename(x))
+    report = build_report(input_dir, html_files, {x: compare_backends(html_files, x) for x in configs},
+                          args.description)
+    if args.output:
+        with open(os.path.join(working_dir, args.output), "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
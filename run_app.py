@@ -3,12 +3,18 @@ import glob
 import imghdr
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from multiprocessing import Pool
 
 from tqdm import tqdm
 
-from src.AutoCorpus import AutoCorpus
+from src.AutoCorpus import AutoCorpus, read_config, HTML_PARSERS
+from src.iao_lexicon import IAOHeadingCache
+from src.run_ledger import RunLedger
+from src.utils import CompiledConfig
 from src.supplementary_processor import supplementary_types
+from src.table import TableParser
 
 parser = argparse.ArgumentParser(prog='PROG')
 parser.add_argument('-f', '--filepath', type=str, help="filepath for document/directory to run AC on")
@@ -19,6 +25,28 @@ parser.add_argument('-o', '--output_format', type=str, default="all",
 parser.add_argument('-s', '--trained_data_set', type=str,
                     help="trained dataset to use with pytesseract, must be in the form pytesseract expects for the lang argument, default eng")
 
+parser.add_argument('-w', '--workers', type=int, default=1,
+                    help="number of worker processes to spread articles across, default 1 (serial)")
+parser.add_argument('-tw', '--table_workers', type=int, default=1,
+                    help="number of worker processes to parse the tables and supplementary PDF pages of each article in "
+                         "parallel, default 1 (serial). Cannot be combined with --workers")
+parser.add_argument('-ot', '--output_threads', type=int, default=1,
+                    help="number of threads writing each article's output files in parallel, default 1 (serial)")
+parser.add_argument('-p', '--html_parser', type=str, default="html.parser", choices=HTML_PARSERS,
+                    help="BeautifulSoup parser used to read HTML inputs, default html.parser. lxml and html5lib have "
+                         "only been checked to give identical output on synthetic PMC style articles, see "
+                         "Tests/ParserEquivalence/report.md")
+parser.add_argument('-ms', '--max_table_span', type=int, default=TableParser.MAX_SPAN,
+                    help=F"largest rowspan/colspan honoured in HTML tables, larger spans are reduced to it, "
+                         F"default {TableParser.MAX_SPAN}")
+parser.add_argument('-mc', '--max_table_cells', type=int, default=TableParser.MAX_GRID_CELLS,
+                    help=F"largest number of cells an HTML table may expand to once its spans are filled in, larger "
+                         F"tables are skipped with a warning, default {TableParser.MAX_GRID_CELLS}")
+parser.add_argument('-i', '--iao_cache', type=str,
+                    help="SQLite file to persist section heading IAO classifications in, shared by all workers and runs")
+parser.add_argument('-r', '--resume', action='store_true',
+                    help="skip articles the run ledger in the target directory records as already processed with the same inputs and config")
+
 group = parser.add_mutually_exclusive_group()
 group.add_argument("-c", "--config", type=str, help="filepath for configuration JSON file")
 group.add_argument("-d", "--config_dir", type=str, help="directory of configuration JSON files")
@@ -33,6 +61,18 @@ output_format = args.output_format if args.output_format else "JSON"
 # TODO: check if this is correct, seemed like a copy paste error as trained_data should be a lanaguge such as `eng`
 # trained_data = args.trained_data_set if args.output_format else "eng"
 trained_data = args.trained_data_set if args.trained_data_set else "eng"
+html_parser = args.html_parser
+max_table_span = args.max_table_span
+max_table_cells = args.max_table_cells
+iao_cache = args.iao_cache
+workers = args.workers if args.workers and args.workers > 1 else 1
+output_threads = args.output_threads if args.output_threads and args.output_threads > 1 else 1
+table_workers = args.table_workers if args.table_workers and args.table_workers > 1 else 1
+if workers > 1 and table_workers > 1:
+    # article worker processes are daemonic and cannot start pools of their own
+    parser.error("--table_workers cannot be combined with --workers")
+if max_table_span < 1 or max_table_cells < 1:
+    parser.error("--max_table_span and --max_table_cells must be at least 1")
 
 
 def get_file_type(file_path):
@@ -150,80 +190,179 @@ def read_file_structure(file_path, target_dir):
     pass
 
 
-structure = read_file_structure(file_path, target_dir)
-pbar = tqdm(structure.keys())
-cdate = datetime.now()
+def process_article(key, article, config, base_dir, output_format, html_parser="html.parser", table_pool=None,
+                    output_executor=None, max_table_span=TableParser.MAX_SPAN,
+                    max_table_cells=TableParser.MAX_GRID_CELLS):
+    '''
+    runs Auto-CORPus over one group of related files and writes the outputs into the group's out_dir
 
-config = args.config
-config_dir = args.config_dir
-associated_data = args.associated_data
-error_occurred = False
-output_format = args.output_format if args.output_format else "JSON"
-# TODO: check if this is correct, seemed like a copy paste error as trained_data should be a lanaguge such as `eng`
-# trained_data = args.trained_data_set if args.output_format else "eng"
-trained_data = args.trained_data_set if args.trained_data_set else "eng"
-if not os.path.exists(target_dir):
-    os.makedirs(target_dir)
-logFileName = F"{target_dir}/autoCORPus-log-{cdate.day}-{cdate.month}-{cdate.year}-{cdate.hour}-{cdate.minute}"
-
-with open(logFileName, "w") as log_file:
-    log_file.write(F"Auto-CORPus log file from {cdate.hour}:{cdate.minute} on {cdate.day}/{cdate.month}/{cdate.year}\n")
-    log_file.write(F"Input directory provided: {file_path}\n")
-    log_file.write(F"Output directory provided: {target_dir}\n")
-    log_file.write(F"Config provided: {config}\n")
-    log_file.write(F"Output format: {output_format}\n")
-    success = []
-    errors = []
-    for key in pbar:
-        pbar.set_postfix(
-            {
-                "file": key + "*",
-                "linked_tables": len(structure[key]['linked_tables']),
-                "table_images": len(structure[key]['table_images']),
-                "supplementary_files": len(structure[key]['supplementary_files'])
-            }
-        )
-        if os.path.isdir(file_path):
-            base_dir = file_path
+    :param key: base file name of the group
+    :param article: structure dict entry for the group
+    :param config: config file path, config dict or CompiledConfig
+    :param base_dir: root directory of the input files
+    :param output_format: JSON, XML or all
+    :param html_parser: BeautifulSoup parser used to read the HTML inputs
+    :param table_pool: optional process pool to parse the article's tables in parallel
+    :param output_executor: optional thread pool executor to write the article's output files in parallel
+    :param max_table_span: largest rowspan/colspan honoured in HTML tables
+    :param max_table_cells: largest number of cells an HTML table may expand to
+    :return: tuple of (success message, error message, list of the files written), one of the messages is None
+    '''
+    try:
+        AC = AutoCorpus(config, base_dir=base_dir, main_text=article['main_text'],
+                        linked_tables=sorted(article['linked_tables']),
+                        supplementary_files=sorted(article['supplementary_files']), html_parser=html_parser,
+                        table_pool=table_pool, max_table_span=max_table_span, max_table_cells=max_table_cells)
+
+        out_dir = article['out_dir']
+        # several workers may share an out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        if article["main_text"]:
+            key = key.replace('\\', '/')
+        outputs = AC.write_outputs(out_dir + "/" + key.split("/")[-1], output_format, output_executor)
+        return F"{key} was processed successfully.", None, outputs
+    except Exception as e:
+        return None, F"{key} failed due to {e}.", []
+
+
+worker_args = {}
+
+
+def init_worker(config, base_dir, output_format, html_parser, iao_cache_path, output_threads=1,
+                max_table_span=TableParser.MAX_SPAN, max_table_cells=TableParser.MAX_GRID_CELLS):
+    '''
+    process pool initializer, keeps the config compiled by the parent for every article the worker processes
+    '''
+    worker_args['config'] = config
+    worker_args['base_dir'] = base_dir
+    worker_args['output_format'] = output_format
+    worker_args['html_parser'] = html_parser
+    worker_args['output_executor'] = ThreadPoolExecutor(output_threads) if output_threads > 1 else None
+    worker_args['max_table_span'] = max_table_span
+    worker_args['max_table_cells'] = max_table_cells
+    IAOHeadingCache.configure(db_path=iao_cache_path)
+
+
+def process_article_in_worker(item):
+    key, article, inputs = item
+    # inputs are hashed in the worker unless the parent already hashed them to check the ledger
+    if inputs is None:
+        inputs = RunLedger.hash_inputs(article)
+    return key, inputs, process_article(key, article, **worker_args), (os.getpid(), IAOHeadingCache.get().stats())
+
+
+def article_postfix(key, article):
+    return {
+        "file": key + "*",
+        "linked_tables": len(article['linked_tables']),
+        "table_images": len(article['table_images']),
+        "supplementary_files": len(article['supplementary_files'])
+    }
+
+
+if __name__ == "__main__":
+    structure = read_file_structure(file_path, target_dir)
+    cdate = datetime.now()
+
+    config = args.config
+    config_dir = args.config_dir
+    associated_data = args.associated_data
+    error_occurred = False
+    output_format = args.output_format if args.output_format else "JSON"
+    # TODO: check if this is correct, seemed like a copy paste error as trained_data should be a lanaguge such as `eng`
+    # trained_data = args.trained_data_set if args.output_format else "eng"
+    trained_data = args.trained_data_set if args.trained_data_set else "eng"
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    logFileName = F"{target_dir}/autoCORPus-log-{cdate.day}-{cdate.month}-{cdate.year}-{cdate.hour}-{cdate.minute}"
+    if os.path.isdir(file_path):
+        base_dir = file_path
+    else:
+        base_dir = "/".join(file_path.split("/")[:-1])
+
+    ledger = RunLedger(target_dir)
+    config_hash = RunLedger.hash_file(config)
+    settings = RunLedger.get_settings(output_format, html_parser, max_table_span, max_table_cells)
+    # inputs are only hashed up front to check the ledger, otherwise as each article is processed
+    input_hashes = {}
+    skipped = []
+    if args.resume:
+        for key in list(structure.keys()):
+            input_hashes[key] = RunLedger.hash_inputs(structure[key])
+            if ledger.is_complete(key, input_hashes[key], config_hash, settings):
+                skipped.append(key)
+                del structure[key]
+
+    with open(logFileName, "w") as log_file:
+        log_file.write(F"Auto-CORPus log file from {cdate.hour}:{cdate.minute} on {cdate.day}/{cdate.month}/{cdate.year}\n")
+        log_file.write(F"Input directory provided: {file_path}\n")
+        log_file.write(F"Output directory provided: {target_dir}\n")
+        log_file.write(F"Config provided: {config}\n")
+        log_file.write(F"Output format: {output_format}\n")
+        log_file.write(F"HTML parser: {html_parser}\n")
+        log_file.write(F"Table limits: spans of at most {max_table_span}, at most {max_table_cells} cells\n")
+        success = []
+        errors = []
+        # the config is read and compiled once here, so a bad config path stops the run before any worker starts
+        compiled_config = CompiledConfig(read_config(config))
+        if workers > 1:
+            with Pool(workers, initializer=init_worker, initargs=(compiled_config, base_dir, output_format, html_parser,
+                                                                  iao_cache, output_threads, max_table_span,
+                                                                  max_table_cells)) as pool:
+                items = ((key, article, input_hashes.get(key)) for key, article in structure.items())
+                # articles are recorded in the ledger as soon as they finish, whatever order that is in
+                pbar = tqdm(pool.imap_unordered(process_article_in_worker, items), total=len(structure))
+                worker_cache_stats = {}
+                results = {}
+                for key, inputs, (done, error, outputs), (pid, cache_stats) in pbar:
+                    worker_cache_stats[pid] = cache_stats
+                    pbar.set_postfix(article_postfix(key, structure[key]))
+                    ledger.record(key, inputs, config_hash, settings, "success" if done else "error", done or error,
+                                  outputs)
+                    results[key] = done, error
+            # the log lists articles in submission order, as in a serial run
+            for key in structure:
+                done, error = results[key]
+                if done:
+                    success.append(done)
+                else:
+                    errors.append(error)
+                    error_occurred = True
+            iao_cache_stats = {x: sum(y[x] for y in worker_cache_stats.values())
+                               for x in ["hits", "disk_hits", "misses"]}
         else:
-            base_dir = "/".join(file_path.split("/")[:-1])
-        try:
-            AC = AutoCorpus(config, base_dir=base_dir, main_text=structure[key]['main_text'],
-                            linked_tables=sorted(structure[key]['linked_tables']),
-                            supplementary_files=sorted(structure[key]['supplementary_files']))
-
-            out_dir = structure[key]['out_dir']
-            if not os.path.exists(out_dir):
-                os.mkdir(out_dir)
-            if structure[key]["main_text"]:
-                key = key.replace('\\', '/')
-                if output_format.lower() in ["json", "all"]:
-                    with open(out_dir + "/" + key.split("/")[-1] + "_bioc.json", "w", encoding='utf-8') as outfp:
-                        outfp.write(AC.main_text_to_bioc_json())
-                    with open(out_dir + "/" + key.split("/")[-1] + "_abbreviations.json", "w", encoding='utf-8') as outfpA:
-                        outfpA.write(AC.abbreviations_to_bioc_json())
-                if output_format.lower() in ["xml", "all"]:
-                    with open(out_dir + "/" + key.split("/")[-1] + "_bioc.xml", "w", encoding='utf-8') as outfp:
-                        outfp.write(AC.main_text_to_bioc_xml())
-                    # with open(out_dir + "/" + key.split("/")[-1] + "_abbreviations.xml", "w", encoding='utf-8') as outfpA:
-                    #     outfpA.write(AC.abbreviations_to_bioc_xml())
-
-            # AC does not support the conversion of tables or abbreviations to the XML format
-            if AC.has_tables:
-                if output_format.lower() in ["json", "all"]:
-                    with open(out_dir + "/" + key.split("/")[-1] + "_tables.json", "w", encoding='utf-8') as outfp:
-                        outfp.write(AC.tables_to_bioc_json())
-                if output_format.lower() in ["xml", "all"]:
-                    with open(out_dir + "/" + key.split("/")[-1] + "_tables.xml", "w", encoding='utf-8') as out_fp:
-                        out_fp.write(AC.tables_to_bioc_xml())
-            success.append(F"{key} was processed successfully.")
-        except Exception as e:
-            errors.append(F"{key} failed due to {e}.")
-            error_occurred = True
-
-    log_file.write(F"{len(success)} files processed.\n")
-    log_file.write(F"{len(errors)} files not processed due to errors.\n\n\n")
-    log_file.write("\n".join(success) + "\n")
-    log_file.write("\n".join(errors) + "\n")
-    if error_occurred:
-        print("Auto-CORPus has completed processing with some errors. Please inspect the log file for further details.")
\ No newline at end of file
+            IAOHeadingCache.configure(db_path=iao_cache)
+            table_pool = Pool(table_workers) if table_workers > 1 else None
+            output_executor = ThreadPoolExecutor(output_threads) if output_threads > 1 else None
+            pbar = tqdm(structure.keys())
+            for key in pbar:
+                pbar.set_postfix(article_postfix(key, structure[key]))
+                inputs = input_hashes[key] if key in input_hashes else RunLedger.hash_inputs(structure[key])
+                done, error, outputs = process_article(key, structure[key], compiled_config, base_dir, output_format,
+                                                       html_parser, table_pool, output_executor, max_table_span,
+                                                       max_table_cells)
+                ledger.record(key, inputs, config_hash, settings, "success" if done else "error", done or error,
+                              outputs)
+                if done:
+                    success.append(done)
+                else:
+                    errors.append(error)
+                    error_occurred = True
+            if table_pool:
+                table_pool.close()
+                table_pool.join()
+            if output_executor:
+                output_executor.shutdown()
+            iao_cache_stats = IAOHeadingCache.get().stats()
+
+        log_file.write(F"{len(success)} files processed.\n")
+        log_file.write(F"{len(errors)} files not processed due to errors.\n")
+        if args.resume:
+            log_file.write(F"{len(skipped)} files skipped as already processed in a previous run.\n")
+        log_file.write(F"IAO heading cache: {iao_cache_stats['hits']} hits, {iao_cache_stats['disk_hits']} read from disk, "
+                       F"{iao_cache_stats['misses']} misses.\n")
+        log_file.write("\n\n")
+        log_file.write("\n".join(success) + "\n")
+        log_file.write("\n".join(errors) + "\n")
+        if error_occurred:
+            print("Auto-CORPus has completed processing with some errors. Please inspect the log file for further details.")
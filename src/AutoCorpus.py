@@ -1,24 +1,27 @@
 import argparse
+import io
 import json
 import os
 import sys
 from typing import Union
 
 import bioc.biocxml
-# noinspection PyProtectedMember
-from bioc import loads, dumps, BioCFileType
 from bioc.biocxml.encoder import encode_infons, encode_sentence, encode_annotation, encode_relation
 from bs4 import Comment, BeautifulSoup
 
 import supplementary_processor
 from src.abbreviation import Abbreviations
-from src.bioc_formatter import BiocFormatter
+from src.bioc_formatter import BiocFormatter, write_bioc_json
 from src.section import Section
 from src.table import TableParser
-from src.utils import handle_not_tables
+from src.utils import handle_not_tables, CompiledConfig
 from lxml import etree
 
 
+# BeautifulSoup tree builders which can be selected for reading input HTML
+HTML_PARSERS = ["html.parser", "lxml", "html5lib"]
+
+
 def handle_path(func: callable) -> callable:
     def inner_function(*args, **kwargs):
         try:
@@ -35,17 +38,18 @@ def handle_path(func: callable) -> callable:
     return inner_function
 
 
+@handle_path
+def read_config(config_path: str) -> dict:
+    with open(config_path, "r") as f:
+        # TODO: validate config file here if possible
+        content = json.load(f)
+        return content["config"]
+
+
 class AutoCorpus:
     """
     """
 
-    @handle_path
-    def __read_config(self, config_path: str) -> dict:
-        with open(config_path, "r") as f:
-            # TODO: validate config file here if possible
-            content = json.load(f)
-            return content["config"]
-
     @handle_path
     def __import_file(self, file_path: str) -> tuple:
         with open(file_path, "r") as f:
@@ -58,10 +62,10 @@ class AutoCorpus:
         return
 
     @staticmethod
-    def __soupify_infile(fpath: str) -> BeautifulSoup:
+    def soupify_infile(fpath: str, html_parser: str = "html.parser") -> BeautifulSoup:
         try:
             with open(fpath, "r", encoding="utf-8", errors="replace") as fp:
-                soup = BeautifulSoup(fp.read(), 'html.parser')
+                soup = BeautifulSoup(fp.read(), html_parser)
                 # remove hidden elements
                 for elem in soup.find_all(attrs={'style': ['display:none', 'visibility:hidden']}):
                     elem.extract()
@@ -218,38 +222,58 @@ class AutoCorpus:
         :return: soup object or None
         """
 
-        soup = self.__soupify_infile(file_path)
+        soup = self.soupify_infile(file_path, self.html_parser)
         if not soup:
             return None
         if "tables" in config:
-            if self.tables == {}:
-                self.tables, self.empty_tables = TableParser(config).get_tables(soup, file_path)
-            else:
-                seen_ids = set()
-                for tab in self.tables['documents']:
-                    if "." in tab['id']:
-                        seen_ids.add(tab['id'].split(".")[0])
-                    else:
-                        seen_ids.add(tab['id'])
-                tmp_tables, tmp_empty = TableParser(config).get_tables(soup, file_path)
-                for tabl in tmp_tables['documents']:
-                    if "." in tabl['id']:
-                        tabl_id = tabl['id'].split(".")[0]
-                        tabl_pos = ".".join(tabl['id'].split(".")[1:])
-                    else:
-                        tabl_id = tabl['id']
-                        tabl_pos = None
-                    if tabl_id in seen_ids:
-                        tabl_id = str(len(seen_ids) + 1)
-                        if tabl_pos:
-                            tabl['id'] = F"{tabl_id}.{tabl_pos}"
-                        else:
-                            tabl['id'] = tabl_id
-                    seen_ids.add(tabl_id)
-                self.tables["documents"].extend(tmp_tables["documents"])
-                self.empty_tables.extend(tmp_empty)
+            self.__add_tables(*TableParser(config, self.max_table_span, self.max_table_cells,
+                                           pool=self.table_pool).get_tables(soup, file_path))
         return soup
 
+    def __add_tables(self, tmp_tables: dict, tmp_empty: list) -> None:
+        """
+        adds the tables of one file to those already found, renumbering table ids which are already taken
+        """
+        if self.tables == {}:
+            self.tables, self.empty_tables = tmp_tables, tmp_empty
+            return
+        seen_ids = set()
+        for tab in self.tables['documents']:
+            if "." in tab['id']:
+                seen_ids.add(tab['id'].split(".")[0])
+            else:
+                seen_ids.add(tab['id'])
+        for tabl in tmp_tables['documents']:
+            if "." in tabl['id']:
+                tabl_id = tabl['id'].split(".")[0]
+                tabl_pos = ".".join(tabl['id'].split(".")[1:])
+            else:
+                tabl_id = tabl['id']
+                tabl_pos = None
+            if tabl_id in seen_ids:
+                tabl_id = str(len(seen_ids) + 1)
+                if tabl_pos:
+                    tabl['id'] = F"{tabl_id}.{tabl_pos}"
+                else:
+                    tabl['id'] = tabl_id
+            seen_ids.add(tabl_id)
+        self.tables["documents"].extend(tmp_tables["documents"])
+        self.empty_tables.extend(tmp_empty)
+
+    def __handle_linked_tables(self, linked_tables: list, config: dict) -> None:
+        """
+        parses the linked table files, in parallel when there is a table pool, and adds their tables in file order
+        """
+        if self.table_pool is None or len(linked_tables) < 2 or "tables" not in config:
+            for table_file in linked_tables:
+                self.__handle_html(table_file, config)
+            return
+        tasks = [({"tables": config["tables"]}, x, self.html_parser, self.max_table_span, self.max_table_cells)
+                 for x in linked_tables]
+        for result in self.table_pool.map(get_linked_file_tables, tasks, chunksize=1):
+            if result:
+                self.__add_tables(*result)
+
     def __merge_table_data(self):
         if not self.empty_tables:
             return
@@ -336,18 +360,35 @@ class AutoCorpus:
             return
 
     def __init__(self, config_path, base_dir=None, main_text=None, linked_tables=None,
-                 supplementary_files=None):
+                 supplementary_files=None, html_parser="html.parser", table_pool=None,
+                 max_table_span=TableParser.MAX_SPAN, max_table_cells=TableParser.MAX_GRID_CELLS):
         """
 
-        :param config_path: path to the config file to be used
+        :param config_path: path to the config file to be used, a config dict already loaded with read_config(),
+            or a CompiledConfig shared across documents
         :param base_dir: path to the root directory containing input article files
         :param main_text: path to the main text of the article
         :param linked_tables: list of linked table file paths to be included in this run (HTML files only)
         :param supplementary_files: this still needs sorting
+        :param html_parser: BeautifulSoup tree builder used to read the HTML inputs, one of HTML_PARSERS
+        :param table_pool: optional multiprocessing pool to parse tables and linked table files, and the pages of
+            supplementary PDFs, in parallel
+        :param max_table_span: largest rowspan/colspan honoured in HTML tables, larger spans are reduced to it
+        :param max_table_cells: largest number of cells an HTML table may expand to once its spans are filled in,
+            larger tables are skipped with a warning
         """
+        if html_parser not in HTML_PARSERS:
+            raise ValueError(F"{html_parser} is not a supported HTML parser, choose from {', '.join(HTML_PARSERS)}")
         # handle common
-        config = self.__read_config(config_path)
+        config = config_path if isinstance(config_path, dict) else read_config(config_path)
+        if not isinstance(config, CompiledConfig):
+            config = CompiledConfig(config)
         self.base_dir = base_dir
+        self.html_parser = html_parser
+        self.table_pool = table_pool
+        self.max_table_span = max_table_span
+        self.max_table_cells = max_table_cells
+        self.__bioc_formatter = None
         self.file_path = main_text
         self.main_text = {}
         self.empty_tables = {}
@@ -365,31 +406,57 @@ class AutoCorpus:
                 print(e)
 
         if linked_tables:
-            for table_file in linked_tables:
-                self.__handle_html(table_file, config)
+            self.__handle_linked_tables(linked_tables, config)
         # Disabled image processing for now
         # if table_images:
         #     self.tables = table_image(table_images, self.base_dir, trainedData=trainedData).to_dict()
         if supplementary_files:
-            supplementary_processor.process_supplementary_files(supplementary_files)
+            supplementary_processor.process_supplementary_files(supplementary_files, pool=self.table_pool)
 
         self.__merge_table_data()
         if "documents" in self.tables and not self.tables["documents"] == []:
             self.has_tables = True
 
+    def __get_bioc_formatter(self) -> BiocFormatter:
+        """
+        builds the main text BioC model on first use, every output format is then emitted from the same model
+        """
+        if self.__bioc_formatter is None:
+            self.__bioc_formatter = BiocFormatter(self)
+        return self.__bioc_formatter
+
     def to_bioc(self):
-        return BiocFormatter(self).to_dict()
+        return self.__get_bioc_formatter().to_dict()
 
     def main_text_to_bioc_json(self, indent=2):
-        return BiocFormatter(self).to_json(indent)
+        return self.__get_bioc_formatter().to_json(indent)
+
+    def write_main_text_bioc_json(self, fp, indent=2):
+        """
+        Streams the main text BioC JSON to a text file handle, passage by passage.
+        """
+        self.__get_bioc_formatter().write_json(fp, indent)
 
     def main_text_to_bioc_xml(self):
-        collection = loads(BiocFormatter(self).to_json(2), BioCFileType.BIOC_JSON)
-        return dumps(collection, BioCFileType.BIOC_XML)
+        out = io.BytesIO()
+        self.write_main_text_bioc_xml(out)
+        return out.getvalue().decode("utf-8")
+
+    def write_main_text_bioc_xml(self, fp):
+        """
+        Streams the main text BioC XML to a binary file handle without building bioc objects.
+        """
+        self.__get_bioc_formatter().write_xml(fp)
 
     def tables_to_bioc_json(self, indent=2):
         return json.dumps(self.tables, ensure_ascii=False, indent=indent)
 
+    def write_tables_bioc_json(self, fp, indent=2):
+        """
+        Streams the tables BioC JSON to a text file handle, passage by passage and row by row.
+        """
+        write_bioc_json(self.tables, fp, indent)
+
     def abbreviations_to_bioc_json(self, indent=2):
         return json.dumps(self.abbreviations, ensure_ascii=False, indent=indent)
 
@@ -406,6 +473,38 @@ class AutoCorpus:
     def abbreviations_to_bioc_xml(self):
         pass
 
+    def write_outputs(self, out_prefix: str, output_format: str = "all", executor=None) -> list:
+        """
+        writes every output requested by output_format from the models built for this article
+        :param out_prefix: output file path without the _bioc.json, _tables.xml etc. suffix
+        :param output_format: JSON, XML or all. Abbreviations are only written as JSON
+        :param executor: optional concurrent.futures executor to write the files in parallel
+        :return: list of the files written
+        """
+        writers = []
+        if self.file_path:
+            if output_format.lower() in ["json", "all"]:
+                writers.append((out_prefix + "_bioc.json", self.write_main_text_bioc_json, "w"))
+                writers.append((out_prefix + "_abbreviations.json", self.abbreviations_to_bioc_json, None))
+            if output_format.lower() in ["xml", "all"]:
+                writers.append((out_prefix + "_bioc.xml", self.write_main_text_bioc_xml, "wb"))
+        # AC does not support the conversion of abbreviations to the XML format
+        if self.has_tables:
+            if output_format.lower() in ["json", "all"]:
+                writers.append((out_prefix + "_tables.json", self.write_tables_bioc_json, "w"))
+            if output_format.lower() in ["xml", "all"]:
+                writers.append((out_prefix + "_tables.xml", self.tables_to_bioc_xml, None))
+        # build the shared main text model before any writer threads start
+        if self.file_path:
+            self.__get_bioc_formatter()
+        if executor is None:
+            for writer in writers:
+                write_output(*writer)
+        else:
+            for future in [executor.submit(write_output, *x) for x in writers]:
+                future.result()
+        return [x[0] for x in writers]
+
     def tables_to_bioc_xml(self):
         collection = bioc.biocxml.encoder.BioCCollection()
         collection.source = self.tables["source"]
@@ -432,6 +531,35 @@ class AutoCorpus:
         return bioc.biocxml.dumps(collection)
 
 
+def write_output(path: str, writer: callable, mode: str = None) -> None:
+    """
+    writes one output file
+    :param path: file to write
+    :param writer: returns the output text, or when mode is given streams it to the file handle it is passed
+    :param mode: file mode ("w" or "wb") of the handle writer streams to, None if writer returns the text
+    """
+    if mode is None:
+        with open(path, "w", encoding="utf-8") as fp:
+            fp.write(writer())
+    else:
+        with open(path, mode, encoding=None if "b" in mode else "utf-8") as fp:
+            writer(fp)
+
+
+def get_linked_file_tables(task: tuple) -> Union[tuple, None]:
+    """
+    process pool entry point which reads one linked table file and parses its tables
+    :param task: tuple of (config with a tables definition, linked table file path, HTML parser, max table span,
+        max table cells)
+    :return: tuple of (tables, empty tables) as returned by TableParser.get_tables, or None if the file could not be read
+    """
+    config, file_path, html_parser, max_table_span, max_table_cells = task
+    soup = AutoCorpus.soupify_infile(file_path, html_parser)
+    if not soup:
+        return None
+    return TableParser(config, max_table_span, max_table_cells).get_tables(soup, file_path)
+
+
 def _encode_column_heading(heading):
     """Encode a single table column heading."""
     tree = etree.Element('column_heading', {'cell_id': heading['cell_id']})
@@ -1,17 +1,27 @@
 import logging
+from bisect import bisect_left
 from collections import defaultdict, Counter
 from datetime import datetime
 from pathlib import Path
 
 import regex as re2
 
+QUOTED_CANDIDATE = re2.compile(r'([(])[\'"\p{Pi}]|[\'"\p{Pf}]([);:])')
+TOKEN_SEPARATOR = re2.compile(r'[\s\-]+')
+TOKEN = re2.compile(r'[^\s\-]+')
+LETTER = re2.compile(r'\p{L}')
+
 
 class Abbreviations:
 
     @staticmethod
-    def __yield_lines_from_doc(doc_text):
-        for line in doc_text.split("."):
-            yield line.strip()
+    def __yield_lines_from_doc(doc_texts):
+        """
+        Sentences of every paragraph in document order, sentences never span paragraphs.
+        """
+        for doc_text in doc_texts:
+            for line in doc_text.split("."):
+                yield line.strip()
 
     @staticmethod
     def __conditions(candidate):
@@ -32,15 +42,13 @@ class Abbreviations:
              True if this is a good candidate
         """
         viable = True
-        if re2.match(r'(\p{L}\.?\s?){2,}', candidate.lstrip()):
-            viable = True
         if len(candidate) < 2 or len(candidate) > 10:
             viable = False
         elif len(candidate.split()) > 2:
             viable = False
         elif candidate.islower():  # customize function discard all lower case candidate
             viable = False
-        elif not re2.search(r'\p{L}', candidate):  # \p{L} = All Unicode letter
+        elif not LETTER.search(candidate):  # \p{L} = All Unicode letter
             viable = False
         elif not candidate[0].isalnum():
             viable = False
@@ -107,7 +115,7 @@ class Abbreviations:
                 # print (candidate)
 
                 if self.__conditions(candidate):
-                    new_candidate = Candidate()
+                    new_candidate = Candidate(candidate)
                     new_candidate.set_position(start, stop)
                     yield new_candidate
 
@@ -127,52 +135,22 @@ class Abbreviations:
         Returns:
              candidate definition for this abbreviation
         """
-        # Take the tokens in front of the candidate
-        tokens = re2.split(r'[\s\-]+', sentence[:candidate.start - 2].lower())
         # the char that we are looking for
         key = candidate[0].lower()
+        candidate_freq = candidate.lower().count(key)
 
-        # Count the number of tokens that start with the same character as the candidate
-        first_chars = [t[0] for t in filter(None, tokens)]
+        # Look for the tokens in front of candidate that have a sufficient number of tokens starting with key
+        start = sentence.definition_start(key, candidate_freq, candidate.start - 2)
+        stop = candidate.start - 1
+        candidate = sentence[start:stop]
 
-        definition_freq = first_chars.count(key)
-        candidate_freq = candidate.lower().count(key)
+        # Remove whitespace
+        start = start + len(candidate) - len(candidate.lstrip())
+        stop = stop - len(candidate) + len(candidate.rstrip())
 
-        # Look for the list of tokens in front of candidate that
-        # have a sufficient number of tokens starting with key
-        if candidate_freq <= definition_freq:
-            # we should at least have a good number of starts
-            count = 0
-            start = 0
-            start_index = len(first_chars) - 1
-            while count < candidate_freq:
-                if abs(start) > len(first_chars):
-                    raise ValueError("candidate {} not found".format(candidate))
-                start -= 1
-                # Look up key in the definition
-                try:
-                    start_index = first_chars.index(key, len(first_chars) + start)
-                except ValueError:
-                    pass
-
-                # Count the number of keys in definition
-                count = first_chars[start_index:].count(key)
-
-            # We found enough keys in the definition so return the definition as a definition candidate
-            start = len(' '.join(tokens[:start_index]))
-            stop = candidate.start - 1
-            candidate = sentence[start:stop]
-
-            # Remove whitespace
-            start = start + len(candidate) - len(candidate.lstrip())
-            stop = stop - len(candidate) + len(candidate.rstrip())
-
-            new_candidate = Candidate()
-            new_candidate.set_position(start, stop)
-            return new_candidate
-
-        else:
-            raise ValueError('There are less keys in the tokens in front of candidate than there are in the candidate')
+        new_candidate = Candidate(sentence[start:stop])
+        new_candidate.set_position(start, stop)
+        return new_candidate
 
     @staticmethod
     def __select_definition(definition, abbrev):
@@ -225,7 +203,7 @@ class Abbreviations:
                 else:
                     l_index -= 1
 
-        new_candidate = Candidate()
+        new_candidate = Candidate(definition)
         new_candidate.set_position(definition.start, definition.stop)
         definition = new_candidate
 
@@ -241,22 +219,24 @@ class Abbreviations:
 
         return definition
 
-    def __extract_abbreviation_definition_pairs(self, doc_text=None, most_common_definition=False,
-                                                first_definition=False, all_definition=True):
-        abbrev_map = dict()
+    def __extract_abbreviation_definition_pairs(self, doc_texts):
+        """
+        Single pass of the Schwartz & Hearst scanner over the sentences of all paragraphs.
+
+        Args:
+            doc_texts: paragraph bodies in document order
+        Returns:
+            dict of abbreviation to every definition found for it, in document order
+        """
         list_abbrev_map = defaultdict(list)
-        counter_abbrev_map = dict()
         omit = 0
         written = 0
-        sentence_iterator = enumerate(self.__yield_lines_from_doc(doc_text))
 
-        collect_definitions = False
-        if most_common_definition or first_definition or all_definition:
-            collect_definitions = True
-
-        for i, sentence in sentence_iterator:
+        for i, sentence in enumerate(self.__yield_lines_from_doc(doc_texts)):
+            if '(' not in sentence:
+                continue
             # Remove any quotes around potential candidate terms
-            clean_sentence = re2.sub(r'([(])[\'"\p{Pi}]|[\'"\p{Pf}]([);:])', r'\1\2', sentence)
+            clean_sentence = Sentence(QUOTED_CANDIDATE.sub(r'\1\2', sentence))
             try:
                 for candidate in self.__best_candidates(clean_sentence):
                     try:
@@ -273,39 +253,19 @@ class Abbreviations:
                                                                                                 candidate, e.args[0]))
                             omit += 1
                         else:
-                            # Either append the current definition to the list of previous definitions ...
-                            if collect_definitions:
-                                list_abbrev_map[candidate].append(definition)
-                            else:
-                                # Or update the abbreviations map with the current definition
-                                abbrev_map[candidate] = definition
+                            list_abbrev_map[candidate].append(definition)
                             written += 1
             except (ValueError, IndexError) as e:
                 self.log.debug("{} Error processing sentence {}: {}".format(i, sentence, e.args[0]))
         self.log.debug("{} abbreviations detected and kept ({} omitted)".format(written, omit))
-
-        # Return most common definition for each term
-        if collect_definitions:
-            if most_common_definition:
-                # Return the most common definition for each term
-                for k, v in list_abbrev_map.items():
-                    counter_abbrev_map[k] = Counter(v).most_common(1)[0][0]
-            elif first_definition:
-                # Return the first definition for each term
-                for k, v in list_abbrev_map.items():
-                    counter_abbrev_map[k] = v
-            elif all_definition:
-                for k, v in list_abbrev_map.items():
-                    counter_abbrev_map[k] = v
-            return counter_abbrev_map
-
-        # Or return the last encountered definition for each term
-        return abbrev_map
+        return list_abbrev_map
 
     def __extract_abbreviation(self, main_text):
-        pairs = self.__extract_abbreviation_definition_pairs(doc_text=main_text, most_common_definition=True)
-
-        return pairs
+        """
+        Most common definition of each abbreviation across the whole article, ties going to the first seen.
+        """
+        pairs = self.__extract_abbreviation_definition_pairs([x['body'] for x in main_text['paragraphs']])
+        return {k: Counter(v).most_common(1)[0][0] for k, v in pairs.items()}
 
     @staticmethod
     def __list_to_dict(lst):
@@ -382,12 +342,7 @@ class Abbreviations:
         return abbre_dict
 
     def __get_abbreviations(self, main_text, soup):
-        paragraphs = main_text['paragraphs']
-        all_abbreviations = {}
-        for paragraph in paragraphs:
-            maintext = paragraph['body']
-            pairs = self.__extract_abbreviation(maintext)
-            all_abbreviations.update(pairs)
+        all_abbreviations = self.__extract_abbreviation(main_text)
         author_provided_abbreviations = self.__get_abbre_dict_given_by_author(soup)
 
         abbrev_json = {}
@@ -444,7 +399,7 @@ class Abbreviations:
 
 
 class Candidate(str):
-    def __init__(self):
+    def __init__(self, value):
         super().__init__()
         self.start = 0
         self.stop = 0
@@ -452,3 +407,64 @@ class Candidate(str):
     def set_position(self, start, stop):
         self.start = start
         self.stop = stop
+
+
+class TokenIndex:
+    """
+    Tokens of lower case text split on whitespace and hyphens, with their offsets and the token positions of each
+    first character, so the tokens in front of any offset can be queried without re-splitting the text.
+    """
+
+    def __init__(self, text):
+        # splitting text which starts with a separator yields an empty first token
+        self.leading_separator = bool(TOKEN_SEPARATOR.match(text))
+        self.starts = []
+        self.cumulative_lengths = [0]
+        self.first_char_positions = defaultdict(list)
+        for position, token in enumerate(TOKEN.finditer(text)):
+            self.starts.append(token.start())
+            self.cumulative_lengths.append(self.cumulative_lengths[-1] + len(token.group()))
+            self.first_char_positions[token.group()[0]].append(position)
+
+    def definition_start(self, key, key_count, stop):
+        """
+        Among the tokens starting before stop, find the token holding the key_count-th last occurrence of key as a
+        first character.
+
+        Args:
+            key: first character of the abbreviation
+            key_count: number of occurrences of key in the abbreviation
+            stop: offset of the end of the text in front of the abbreviation
+        Returns:
+            length of the tokens in front of that token when joined by single spaces
+        """
+        positions = self.first_char_positions.get(key, [])
+        definition_freq = bisect_left(positions, bisect_left(self.starts, stop))
+        if key_count > definition_freq:
+            raise ValueError('There are less keys in the tokens in front of candidate than there are in the candidate')
+        start_index = positions[definition_freq - key_count]
+        if start_index == 0:
+            return 0
+        return self.cumulative_lengths[start_index - self.leading_separator] + start_index - 1
+
+
+class Sentence(str):
+    """
+    Sentence which is tokenised once, on first use, and shared by every candidate abbreviation found in it.
+    """
+
+    def __init__(self, value):
+        super().__init__()
+        self.__token_index = None
+        self.__offsets_preserved = True
+
+    def definition_start(self, key, key_count, stop):
+        if self.__token_index is None and self.__offsets_preserved:
+            lowered = self.lower()
+            self.__offsets_preserved = len(lowered) == len(self)
+            self.__token_index = TokenIndex(lowered) if self.__offsets_preserved else None
+        if not self.__offsets_preserved:
+            # lower casing changed some offsets, only the text in front of the candidate can be tokenised
+            lowered = self[:stop].lower()
+            return TokenIndex(lowered).definition_start(key, key_count, len(lowered))
+        return self.__token_index.definition_start(key, key_count, stop)
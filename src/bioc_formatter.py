@@ -1,6 +1,10 @@
 import json
 from datetime import datetime
 
+from bioc.biocjson.decoder import parse_annotation, parse_relation, parse_sentence
+from bioc.biocxml.encoder import encode_annotation, encode_infon, encode_relation, encode_sentence
+from lxml import etree
+
 from src.bioc_documents import BiocDocument
 
 
@@ -24,3 +28,173 @@ class BiocFormatter:
 
     def to_dict(self):
         return self.bioc_output
+
+    def write_json(self, fp, indent_val=None):
+        """
+        Writes the collection as BioC JSON to a text file handle, one passage at a time.
+        The output is identical to to_json(indent_val).
+        """
+        write_bioc_json(self.bioc_output, fp, indent_val)
+
+    def write_xml(self, fp, encoding="utf-8"):
+        """
+        Writes the collection as BioC XML to a binary file handle, one passage at a time.
+        The output is identical to loading the JSON output with bioc and dumping it as BioC XML.
+        """
+        write_bioc_xml(self.bioc_output, fp, encoding)
+
+
+# containers nested deeper than this are encoded in one piece, which covers single table rows and passage infons
+JSON_STREAM_DEPTH = 8
+
+
+def _json_key(encoder, key):
+    if isinstance(key, str):
+        return encoder.encode(key)
+    # json coerces int, float, bool and None keys to strings
+    return json.dumps({key: None})[1:-len(": null}")]
+
+
+def _write_json_value(fp, encoder, value, indent, level, depth):
+    if depth == 0 or not value or not isinstance(value, (dict, list)):
+        text = encoder.encode(value)
+        # nested lines of a pretty printed value are indented relative to where it is written
+        fp.write(text.replace("\n", "\n" + " " * (indent * level)) if indent is not None and level else text)
+        return
+    is_dict = isinstance(value, dict)
+    if indent is None:
+        item_separator, newline = ", ", ""
+    else:
+        item_separator, newline = ",", "\n" + " " * (indent * (level + 1))
+    fp.write("{" if is_dict else "[")
+    for i, item in enumerate(value.items() if is_dict else value):
+        fp.write(item_separator + newline if i else newline)
+        if is_dict:
+            fp.write(_json_key(encoder, item[0]) + ": ")
+            item = item[1]
+        _write_json_value(fp, encoder, item, indent, level + 1, depth - 1)
+    if indent is not None:
+        fp.write("\n" + " " * (indent * level))
+    fp.write("}" if is_dict else "]")
+
+
+def write_bioc_json(collection, fp, indent=None):
+    """
+    Streams a BioC collection dict (full text or tables) as JSON to a text file handle, writing the collection
+    header and then documents, passages and table rows one at a time, so the JSON text of the whole collection is
+    never held in memory.
+
+    :param collection: BioC collection dict
+    :param fp: text file handle to write to
+    :param indent: indent of pretty printed output, None for compact output, as for json.dumps
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, indent=indent)
+    _write_json_value(fp, encoder, collection, indent, 0, JSON_STREAM_DEPTH)
+
+
+class BiocPassageWriter:
+    """
+    Writes a BioC collection of one document as JSON to a text file handle while the document's passages are still
+    being produced, so they never have to be held in memory together. Once closed, the output is identical to
+    json.dumps() of the collection with all of the written passages in its document.
+
+    The collection header and the rest of the document are written from the collection given, ignoring its passages.
+    """
+    __PLACEHOLDER = "\0passages\0"
+    # collection -> documents -> document -> passages
+    __PASSAGES_LEVEL = 3
+
+    def __init__(self, collection, fp, indent=None, ensure_ascii=False):
+        self.fp = fp
+        self.indent = indent
+        self.passage_count = 0
+        self.__encoder = json.JSONEncoder(ensure_ascii=ensure_ascii, indent=indent)
+        document = dict(collection["documents"][0], passages=self.__PLACEHOLDER)
+        skeleton = self.__encoder.encode(dict(collection, documents=[document]))
+        self.__head, self.__tail = skeleton.split(self.__encoder.encode(self.__PLACEHOLDER))
+        fp.write(self.__head + "[")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # the output is left incomplete on errors rather than passed off as a whole collection
+        if exc_type is None:
+            self.close()
+
+    def write(self, passage):
+        if self.indent is None:
+            self.fp.write(", " if self.passage_count else "")
+        else:
+            self.fp.write(("," if self.passage_count else "") + "\n" + " " * (self.indent * (self.__PASSAGES_LEVEL + 1)))
+        _write_json_value(self.fp, self.__encoder, passage, self.indent, self.__PASSAGES_LEVEL + 1,
+                          JSON_STREAM_DEPTH - self.__PASSAGES_LEVEL - 1)
+        self.passage_count += 1
+
+    def close(self):
+        if self.indent is not None and self.passage_count:
+            self.fp.write("\n" + " " * (self.indent * self.__PASSAGES_LEVEL))
+        self.fp.write("]" + self.__tail)
+
+
+def _write_element(xf, elem, level):
+    # pretty prints elem as the libxml2 serialiser would at this depth of the collection
+    etree.indent(elem, level=level)
+    elem.tail = None
+    xf.write("\n" + "  " * level, elem)
+
+
+def _text_element(tag, text):
+    elem = etree.Element(tag)
+    elem.text = text
+    return elem
+
+
+def _encode_passage(passage):
+    elem = etree.Element("passage")
+    for k, v in passage["infons"].items():
+        elem.append(encode_infon(k, v))
+    etree.SubElement(elem, "offset").text = str(passage["offset"])
+    if passage.get("text"):
+        etree.SubElement(elem, "text").text = passage["text"]
+    for sentence in passage["sentences"]:
+        elem.append(encode_sentence(parse_sentence(sentence)))
+    for annotation in passage["annotations"]:
+        elem.append(encode_annotation(parse_annotation(annotation)))
+    for relation in passage["relations"]:
+        elem.append(encode_relation(parse_relation(relation)))
+    return elem
+
+
+def write_bioc_xml(collection, fp, encoding="utf-8"):
+    """
+    Streams a BioC collection dict as pretty printed BioC XML to a binary file handle with lxml's incremental writer,
+    without building bioc objects or the XML tree of the whole collection.
+
+    :param collection: BioC collection dict, as built by BiocFormatter
+    :param fp: binary file handle to write to
+    :param encoding: encoding named in the XML declaration and used for the output
+    """
+    # the incremental writer allows no text outside the root element, so the lines around it are written directly
+    fp.write(F"<?xml version='1.0' encoding='{encoding}' standalone='yes'?>\n".encode(encoding))
+    with etree.xmlfile(fp, encoding=encoding) as xf:
+        with xf.element("collection"):
+            for key in ["source", "date", "key"]:
+                _write_element(xf, _text_element(key, collection[key]), 1)
+            for k, v in collection["infons"].items():
+                _write_element(xf, encode_infon(k, v), 1)
+            for document in collection["documents"]:
+                xf.write("\n  ")
+                with xf.element("document"):
+                    _write_element(xf, _text_element("id", document["id"]), 2)
+                    for k, v in document["infons"].items():
+                        _write_element(xf, encode_infon(k, v), 2)
+                    for passage in document["passages"]:
+                        _write_element(xf, _encode_passage(passage), 2)
+                    for annotation in document.get("annotations", []):
+                        _write_element(xf, encode_annotation(parse_annotation(annotation)), 2)
+                    for relation in document["relations"]:
+                        _write_element(xf, encode_relation(parse_relation(relation)), 2)
+                    xf.write("\n  ")
+            xf.write("\n")
+    fp.write("\n".encode(encoding))
@@ -0,0 +1,52 @@
+import re
+
+from bs4 import Tag
+
+from src.utils import collect_contents
+
+PVAL_REGEX = r'((\d+\.\d+)|(\d+))(\s?)[*××xX](\s{0,1})10[_]{0,1}([–−-])(\d+)'
+PVAL_SCIENTIFIC_REGEX = r'((\d+.\d+)|(\d+))(\s{0,1})[eE](\s{0,1})([–−-])(\s{0,1})(\d+)'
+
+PVAL = re.compile(PVAL_REGEX)
+PVAL_SCIENTIFIC = re.compile(PVAL_SCIENTIFIC_REGEX)
+PVAL_MULTIPLIER = re.compile(r'(\s?)[*×xX](\s?)10(_?)')
+SCIENTIFIC_MINUS = re.compile(r'(\s?)[–−-](\s?)')
+SCIENTIFIC_EXPONENT = re.compile(r'(\s?)[eE]')
+WHITESPACE = re.compile(r"\s")
+MARKUP = re.compile(r"</?span[^>\n]*>?|<hr/>?")
+
+
+def normalise_cell_text(value: str) -> str:
+    """
+    Clean the text of a table cell, rewriting p-values such as 1.2 × 10<sup>−8</sup> or 3.4 E − 5 as 1.2e-8 and 3.4e-5.
+
+    Args:
+        value: text of the cell
+
+    Returns:
+        normalised cell text
+    """
+    value = value.strip().replace('\u2009', ' ').replace("&#x000a0;", " ")
+    value = WHITESPACE.sub(" ", value)
+    if "<" in value:
+        value = MARKUP.sub("", value)
+    if value.startswith('(') and value.endswith(')'):
+        value = value[1:-1]
+    # both p-value forms start with a decimal digit (\d), which rewriting the multiplier never removes
+    if value[:1].isdecimal():
+        if PVAL.match(value):
+            value = PVAL_MULTIPLIER.sub('e', value).replace('−', '-')
+        if PVAL_SCIENTIFIC.match(value):
+            value = SCIENTIFIC_MINUS.sub('-', value)
+            value = SCIENTIFIC_EXPONENT.sub('e', value)
+    return value
+
+
+def normalise_cell(cell: Tag) -> str:
+    """
+    Normalised text of a table cell element, see normalise_cell_text.
+    """
+    parts = []
+    for item in cell.contents:
+        collect_contents(item, parts)
+    return normalise_cell_text("".join(parts))
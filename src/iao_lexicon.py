@@ -0,0 +1,186 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+from collections import OrderedDict
+
+from fuzzywuzzy import fuzz
+
+from src.utils import read_mapping_file, read_iao_term_to_id_file
+
+
+class IAOLexicon:
+    """
+    Section heading to IAO term lexicon, loaded once per process.
+
+    Keeps the semantics of scanning IAO_FINAL_MAPPING.txt in file order and returning the first term with any
+    heading scoring above the fuzzy threshold, but narrows the headings scored:
+        - exact heading hits are found through a hash index, so only earlier terms need fuzzy scoring
+        - headings whose length rules out reaching the threshold are never scored
+    """
+    THRESHOLD = 80
+    __shared = None
+
+    def __init__(self, mapping_dict: dict = None, term_to_id: dict = None) -> None:
+        mapping_dict = read_mapping_file() if mapping_dict is None else mapping_dict
+        self.term_to_id = read_iao_term_to_id_file() if term_to_id is None else term_to_id
+        self.terms = list(mapping_dict.keys())
+        # identifies this lexicon's contents so persisted classifications are not reused after the mapping changes
+        self.version = hashlib.sha256(json.dumps([mapping_dict, self.term_to_id]).encode("utf-8")).hexdigest()[:16]
+        self.__exact = {}
+        self.__by_length = {}
+        for term_idx, headings in enumerate(mapping_dict.values()):
+            for heading in headings:
+                self.__exact.setdefault(heading, term_idx)
+                self.__by_length.setdefault(len(heading), []).append((term_idx, heading))
+
+    @classmethod
+    def get(cls) -> 'IAOLexicon':
+        """
+        Returns the lexicon shared by every document processed in this process.
+        """
+        if cls.__shared is None:
+            cls.__shared = cls()
+        return cls.__shared
+
+    def __candidates(self, heading: str, start: int, stop: int) -> list:
+        """
+        Headings of terms start..stop-1 which could score at least THRESHOLD - 1 against heading, in term order.
+        fuzz.ratio is at most 200 * min(len) / (len(a) + len(b)), so other lengths cannot reach the threshold.
+        """
+        bound = self.THRESHOLD - 1
+        shortest = math.floor(len(heading) * bound / (200 - bound))
+        longest = math.ceil(len(heading) * (200 - bound) / bound)
+        candidates = []
+        for length in range(shortest, longest + 1):
+            candidates.extend(x for x in self.__by_length.get(length, []) if start <= x[0] < stop)
+        candidates.sort(key=lambda x: x[0])
+        return candidates
+
+    def match_term(self, heading: str, strict: bool = False, start: int = 0, stop: int = None) -> str:
+        """
+        Find the first IAO term (in mapping file order) with a heading matching the input.
+
+        Args:
+            heading: lower case section heading
+            strict: require a score above THRESHOLD rather than at least THRESHOLD
+            start: index of the first term to consider
+            stop: index after the last term to consider, defaults to all terms
+
+        Returns:
+            IAO term name or None if no term matches
+        """
+        stop = len(self.terms) if stop is None else stop
+        exact_idx = self.__exact.get(heading)
+        if exact_idx is not None and start <= exact_idx < stop:
+            # an exact hit scores 100, only earlier terms can still take precedence
+            stop = exact_idx
+        else:
+            exact_idx = None
+        for term_idx, candidate in self.__candidates(heading, start, stop):
+            score = fuzz.ratio(heading, candidate)
+            if score > self.THRESHOLD or (not strict and score == self.THRESHOLD):
+                return self.terms[term_idx]
+        return None if exact_idx is None else self.terms[exact_idx]
+
+    def to_iao(self, iao_term: str) -> dict:
+        return {
+            "iao_name": iao_term,
+            "iao_id": self.term_to_id.get(iao_term, '')
+        }
+
+
+class IAOHeadingCache:
+    """
+    Memoised section heading to IAO classification, shared by every document in the process.
+
+    Classifications are held in a bounded LRU and, when a database path is configured, persisted to SQLite keyed by
+    the normalised heading and the lexicon version, so warm runs and other worker processes can reuse them.
+    """
+    __shared = None
+
+    def __init__(self, lexicon: IAOLexicon = None, max_size: int = 10000, db_path: str = None) -> None:
+        self.lexicon = IAOLexicon.get() if lexicon is None else lexicon
+        self.max_size = max_size
+        self.db_path = db_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__connection = None
+        self.__connection_pid = None
+
+    @classmethod
+    def get(cls) -> 'IAOHeadingCache':
+        if cls.__shared is None:
+            cls.__shared = cls()
+        return cls.__shared
+
+    @classmethod
+    def configure(cls, max_size: int = 10000, db_path: str = None) -> 'IAOHeadingCache':
+        """
+        Replace the shared cache, e.g. to enable on-disk persistence for a batch run.
+        """
+        cls.__shared = cls(max_size=max_size, db_path=db_path)
+        return cls.__shared
+
+    @staticmethod
+    def normalise(heading: str) -> str:
+        # whitespace only separates tokens for the IAO matching, so runs of it can be collapsed
+        return " ".join(heading.split())
+
+    def __db(self) -> sqlite3.Connection:
+        # connections cannot be shared with forked worker processes, so each process opens its own
+        if self.__connection is None or self.__connection_pid != os.getpid():
+            self.__connection = sqlite3.connect(self.db_path, timeout=30)
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS iao_headings (heading TEXT, lexicon_version TEXT, "
+                                      "section_type TEXT, PRIMARY KEY (heading, lexicon_version))")
+            self.__connection.commit()
+            self.__connection_pid = os.getpid()
+        return self.__connection
+
+    def __remember(self, key: str, section_type: list) -> None:
+        self.__entries[key] = section_type
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+    def get_section_type(self, heading: str):
+        """
+        Returns a copy of the cached classification for heading, or None if it has not been classified yet.
+        """
+        key = self.normalise(heading)
+        section_type = self.__entries.get(key)
+        if section_type is not None:
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            return [dict(x) for x in section_type]
+        if self.db_path:
+            row = self.__db().execute("SELECT section_type FROM iao_headings WHERE heading = ? AND lexicon_version = ?",
+                                      (key, self.lexicon.version)).fetchone()
+            if row:
+                self.disk_hits += 1
+                section_type = json.loads(row[0])
+                self.__remember(key, section_type)
+                return [dict(x) for x in section_type]
+        self.misses += 1
+        return None
+
+    def put_section_type(self, heading: str, section_type: list) -> None:
+        key = self.normalise(heading)
+        self.__remember(key, [dict(x) for x in section_type])
+        if self.db_path:
+            db = self.__db()
+            db.execute("INSERT OR REPLACE INTO iao_headings VALUES (?, ?, ?)",
+                       (key, self.lexicon.version, json.dumps(section_type)))
+            db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self.__entries)
+        }
@@ -1,18 +1,22 @@
 import datetime
-import io
 import json
 import os
-from copy import deepcopy
+from copy import copy
 from os.path import join
 
-import PyPDF2
 import pandas
 from bioc import BioCCollection
 import pdfplumber
+from pdfplumber.table import words_to_edges_v, DEFAULT_MIN_WORDS_VERTICAL
 import logging
 
+from src.bioc_formatter import BiocPassageWriter
+
 logging.basicConfig(filename="PDFExtractor.log", level=logging.ERROR, format="%(asctime)s - %(levelname)s - %("
                                                                              "message)s")
+# pages skipped by table extraction are logged at info level, which the error level set above would otherwise filter out
+table_skip_logger = logging.getLogger("pdf_extractor.table_skip")
+table_skip_logger.setLevel(logging.INFO)
 
 pdf_data = None
 filename = ""
@@ -24,6 +28,8 @@ plumber_config = {
     "vertical_strategy": "text",
     "horizontal_strategy": "lines"
 }
+# pages extracted by each process pool task in page-parallel mode
+PAGES_PER_TASK = 20
 
 
 class BioCText:
@@ -417,97 +423,212 @@ def restructure_rows(input_list, column_count):
     return new_rows, new_heading_rows
 
 
-def rotate_page(file, page):
+class PDFSession:
     """
-    Rotate a specific page of a PDF file and extract tables using pdfplumber.
+    A PDF file opened once for the processing of all of its pages.
 
-    Args:
-        file (str): The path of the input PDF file.
-        page (int): The page number to be rotated and processed.
+    Holds one pdfplumber document, used for orientation detection and for text and table extraction. Rotated pages are
+    derived from it in memory, so processing a PDF parses the file once rather than once per page.
+    """
 
-    Returns:
-        list or bool: If successful, returns the extracted tables as a list.
-                      Otherwise, returns False if an error occurs.
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.pdf = pdfplumber.open(input_file)
 
-    The function rotates a specific page (`page`) of a PDF file (`file`) and extracts tables using the pdfplumber library.
+    def __enter__(self):
+        return self
 
-    It first reads the PDF file using PyPDF2.PdfReader and makes a deepcopy of the desired page using reader.pages[page].
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-    The function then extracts the text from the page at the initial orientation (0 degrees) and calculates the average line length.
+    def close(self):
+        self.pdf.close()
 
-    It performs a loop to rotate the page in 90-degree increments, extract the text, and calculate the average line length for each rotation.
-    The rotation_line_length_counts list keeps track of the average line length for each rotation.
+    @property
+    def pages(self):
+        return self.pdf.pages
 
-    After the loop, the function determines the final rotation based on the rotation with the maximum average line length.
-    If all rotations have the same average line length, the final rotation is set to 0.
+    @staticmethod
+    def get_char_orientation(matrix):
+        """
+        Classify a character's text matrix as 0, 90, 180 or 270 degrees, in the same way as PyPDF2's extract_text.
+        """
+        if matrix[3] > 1e-6:
+            return 0
+        elif matrix[3] < -1e-6:
+            return 180
+        elif matrix[1] > 0:
+            return 90
+        return 270
+
+    def get_rotation(self, page_idx):
+        """
+        Determine the clockwise rotation which makes a page read horizontally.
 
-    The function sets new_page to the original page from the reader.
-    If a final_rotation is required, it rotates the new_page accordingly.
+        Args:
+            page_idx (int): The index of the page within the PDF.
 
-    Then, it writes the rotated page to a BytesIO stream using PyPDF2.PdfWriter and PyPDF2.PdfWriter.write().
+        Returns:
+            int: 0, 90, 180 or 270.
 
-    If any exception occurs during the writing process, it logs an error message and returns False.
+        See detect_rotation() for how it is chosen. The rotation is not cached, as detection reads the characters the
+        page's text extraction parses anyway and takes well under 1% of the time spent on a page.
+        """
+        return self.detect_rotation(self.pdf.pages[page_idx])
 
-    If the writing process is successful, the function seeks to the beginning of the stream and opens it as a buffered reader.
+    @classmethod
+    def detect_rotation(cls, page):
+        """
+        Determine the clockwise rotation which makes a page read horizontally, from the geometry of its characters.
 
-    It opens the buffered reader with pdfplumber to get a plumber_page object.
+        Args:
+            page (pdfplumber.Page): The page, as laid out with the rotation set in the PDF.
 
-    The function extracts tables from the plumber_page using pdfplumber.Page.extract_tables() and the best plumber configuration
-    obtained from get_best_plumber_config().
+        Returns:
+            int: 0, 90, 180 or 270.
+
+        Each character is assigned the orientation of its text matrix relative to the unrotated page content, and the
+        characters of each orientation are split into lines as PyPDF2 extracted them, previously used to decide the
+        rotation by extracting the text at each orientation: characters are taken in content stream order, and a line
+        ends where the baseline moves down the text, as read in its orientation, by more than 0.8 times the font size
+        from the previous character of any orientation. Text whose lines are laid out upwards, such as the rows of some
+        sideways tables, is therefore read as a single line. The orientation with the longest average line length is
+        chosen, the earliest of 0, 90, 180 and 270 on ties. Pages whose characters all share one orientation need no
+        line splitting.
+        """
+        chars = page.chars
+        if not chars:
+            return 0
+        orientations = {cls.get_char_orientation(x["matrix"]) for x in chars}
+        if len(orientations) == 1:
+            return (orientations.pop() + page.rotation) % 360
+        # orientation -> [characters, lines, whether the current line has text]
+        lines = {orientation: [0, 1, False] for orientation in range(0, 360, 90)}
+        previous = None
+        for char in chars:
+            matrix = char["matrix"]
+            orientation = cls.get_char_orientation(matrix)
+            line = lines[orientation]
+            if previous is not None:
+                # distance the baseline moved down the text, as read in its orientation, from the previous character
+                down = {0: previous["matrix"][5] - matrix[5], 90: matrix[4] - previous["matrix"][4],
+                        180: matrix[5] - previous["matrix"][5], 270: previous["matrix"][4] - matrix[4]}[orientation]
+                if down > 0.8 * char["size"]:
+                    if line[2]:
+                        line[1] += 1
+                        line[2] = False
+                elif abs(down) < 0.3 * char["size"] and line[2]:
+                    if orientation in (0, 180):
+                        gap = max(char["x0"] - previous["x1"], previous["x0"] - char["x1"])
+                    else:
+                        gap = max(char["top"] - previous["bottom"], previous["top"] - char["bottom"])
+                    # separate runs of text on a line, such as table cells, are joined by a space
+                    if gap > 0.3 * char["size"]:
+                        line[0] += 1
+            line[0] += 1
+            line[2] = True
+            previous = char
+        avg_line_lengths = [0, 0, 0, 0]
+        for orientation, (char_count, line_count, _) in lines.items():
+            avg_line_lengths[(orientation + page.rotation) % 360 // 90] = char_count / line_count
+        return avg_line_lengths.index(max(avg_line_lengths)) * 90
+
+    def get_rotated_page(self, page_idx, rotation):
+        """
+        Get a pdfplumber page turned clockwise by rotation degrees, in addition to any rotation the PDF already sets.
 
-    Finally, it returns the extracted tables as a list if successful or False if an error occurs.
-    """
-    reader = PyPDF2.PdfReader(file)
-    new_page = deepcopy(reader.pages[page])
-    # Extract text from the page at the initial orientation (0 degrees)
-    page_text = new_page.extract_text(orientations=(0)).split("\n")
-    avg_line_length = sum(len(s) for s in page_text) / len(page_text) if len(page_text) > 0 else 0
-    rotation_count = 0
-    rotation_line_length_counts = [avg_line_length]
-
-    # Rotate the page in 90-degree increments and calculate average line length for each rotation
-    while rotation_count < 3:
-        page_text = new_page.extract_text(orientations=(90 * (rotation_count + 1))).split("\n")
-        avg_line_length = sum(len(s) for s in page_text) / len(page_text) if len(page_text) > 0 else 0
-        rotation_line_length_counts.append(avg_line_length)
-        rotation_count += 1
-
-    # Determine the final rotation based on the rotation with the maximum average line length
-    if len(set(rotation_line_length_counts)) > 1:
-        final_rotation = (rotation_line_length_counts.index(max(rotation_line_length_counts))) * 90
-    else:
-        final_rotation = 0
+        Args:
+            page_idx (int): The index of the page within the PDF.
+            rotation (int): A multiple of 90.
 
-    new_page = reader.pages[page]
+        Returns:
+            pdfplumber.Page: The page itself if rotation is 0, otherwise a new page over a copy of its page object.
+        """
+        page = self.pdf.pages[page_idx]
+        if not rotation % 360:
+            return page
+        page_obj = copy(page.page_obj)
+        page_obj.attrs = dict(page_obj.attrs, Rotate=(page.rotation + rotation) % 360)
+        # pdfminer lays the page out using the rotation it read when the page object was created
+        page_obj.rotate = page_obj.attrs["Rotate"]
+        return pdfplumber.page.Page(self.pdf, page_obj, page_number=page.page_number,
+                                    initial_doctop=page.initial_doctop)
+
+
+def get_table_skip_reason(page):
+    """
+    Decide whether a page can contain a table before running table extraction on it.
 
-    # Rotate the new_page if a final rotation is required
-    if final_rotation:
-        new_page.rotate(final_rotation)
-    with io.BytesIO() as stream:
-        try:
-            # Write the rotated page to the stream
-            writer = PyPDF2.PdfWriter(stream)
-            writer.add_page(new_page)
-            writer.write(stream)
-        except AssertionError as ae:
-            logging.error(msg=F"{file} raised the following error: {ae}")
-            return False
-        except Exception as ex:
-            logging.error(msg=F"{file} raised the following error: {ex}")
-            return False
+    Args:
+        page (pdfplumber.Page): The page, rotated as it will be for table extraction.
+
+    Returns:
+        str or None: Why the page cannot contain a table, or None if the page is a table candidate.
+
+    Table extraction always takes row boundaries from ruling lines (`"horizontal_strategy": "lines"`), so a table needs
+    horizontal edges at two or more heights. Pages of prose have none, or a single header or footnote rule.
+
+    Column boundaries come from vertical edges or, with the "text" vertical strategy, from words aligned in columns, so
+    a table also needs two or more of either. The alignment test is the one pdfplumber applies, and only runs on pages
+    with horizontal rulings.
+
+    Edges are counted before pdfplumber snaps and joins them, so a page is only skipped when extraction could not find
+    a table on it.
+    """
+    edges = page.edges
+    horizontal = {round(x["top"]) for x in edges if x["orientation"] == "h"}
+    if len(horizontal) < 2:
+        return F"horizontal ruling lines at {len(horizontal)} heights"
+    vertical = {round(x["x0"]) for x in edges if x["orientation"] == "v"}
+    if len(vertical) >= 2:
+        return None
+    columns = words_to_edges_v(page.extract_words(), word_threshold=DEFAULT_MIN_WORDS_VERTICAL)
+    if len(columns) < 2:
+        return F"vertical ruling lines at {len(vertical)} positions and {len(columns)} aligned text columns"
+    return None
+
+
+def rotate_page(file, page):
+    """
+    Rotate a specific page of a PDF file and extract tables using pdfplumber.
+
+    Args:
+        file (str or PDFSession): The path of the input PDF file, or the session it is already open in.
+        page (int): The page number to be rotated and processed.
+
+    Returns:
+        list or bool: If successful, returns the extracted tables as a list.
+                      Otherwise, returns False if no tables were found.
 
-        # Seek to the beginning of the stream and open it as a buffered reader
-        stream.seek(0)
-        reader = io.BufferedReader(stream)
+    The function rotates a specific page (`page`) of a PDF file (`file`) and extracts tables using the pdfplumber library.
+
+    When given a file path, it opens a PDFSession for the file, which should be avoided when processing several pages.
 
-        # Open the buffered reader with pdfplumber
-        plumber_page = pdfplumber.open(reader)
-        new_page = plumber_page.pages[0]
+    It determines the rotation of the page using PDFSession.get_rotation(), which compares the average line length of the
+    page's characters at each orientation of their text matrices.
 
-        # Extract tables from the plumber_page using the best plumber configuration
-        data = None
-        data = new_page.extract_tables(table_settings=get_best_plumber_config(new_page))
-        return data if data else False
+    It then gets the rotated pdfplumber page from PDFSession.get_rotated_page(), without writing the page out to a new PDF.
+
+    Pages which get_table_skip_reason() shows cannot contain a table are logged and skipped.
+
+    The function extracts tables from the page using pdfplumber.Page.extract_tables() and the best plumber configuration
+    obtained from get_best_plumber_config().
+
+    Finally, it returns the extracted tables as a list if successful or False if no tables were found.
+    """
+    if not isinstance(file, PDFSession):
+        with PDFSession(file) as session:
+            return rotate_page(session, page)
+    plumber_page = file.get_rotated_page(page, file.get_rotation(page))
+    # Only run table extraction on pages which can contain a table
+    skip_reason = get_table_skip_reason(plumber_page)
+    if skip_reason:
+        table_skip_logger.info(F"Skipped table extraction on page {page + 1} of {file.input_file}: {skip_reason}")
+        return False
+
+    # Extract tables from the plumber_page using the best plumber configuration
+    data = plumber_page.extract_tables(table_settings=get_best_plumber_config(plumber_page))
+    return data if data else False
 
 
 def validate_bounding_box(page, bbox):
@@ -570,7 +691,7 @@ def get_best_plumber_config(page):
 
     The function takes a pdfplumber.Page object as input, representing a single page in a PDF.
 
-    It first initializes the `new_plumber_config` variable with the initial configuration stored in `plumber_config`.
+    It first initializes the `new_plumber_config` variable with a copy of the initial configuration stored in `plumber_config`.
 
     The function attempts to find tables on the page using the `find_tables()` method of the `page` object.
     If tables are found, it performs the following steps:
@@ -588,7 +709,8 @@ def get_best_plumber_config(page):
     Finally, the function returns the `new_plumber_config` dictionary containing the best configuration options for table extraction.
     """
     table_area = None
-    new_plumber_config = plumber_config
+    # a copy, so the strategy chosen for one page is not carried over to the pages after it
+    new_plumber_config = dict(plumber_config)
     # Find tables on the page
     tables = []
     try:
@@ -628,82 +750,198 @@ def get_best_plumber_config(page):
     return new_plumber_config
 
 
-def process_pdf(input_file):
+def extract_page_data(session, page_idx):
+    """
+    Extract the text lines and raw tables of one page.
+
+    Args:
+        session (PDFSession): The session the PDF is open in.
+        page_idx (int): The index of the page within the PDF.
+
+    Returns:
+        tuple: The page text split into lines, and the tables found by rotate_page() as lists of rows or False.
+    """
+    # Extract text from the page and split into lines
+    page_text = session.pages[page_idx].extract_text().split("\n")
+    # Check if the page needs rotation and perform necessary rotations
+    data = rotate_page(session, page_idx)
+    # Release the page's parsed layout objects, which the pdfplumber document would otherwise keep until it is closed.
+    # This is what Page.close() does from pdfplumber 0.10 on, done directly as the pinned 0.9 has no close()
+    page = session.pages[page_idx]
+    page.flush_cache()
+    page.get_textmap.cache_clear()
+    return page_text, data
+
+
+def extract_pages(task):
+    """
+    Process pool entry point, extracts the text lines and raw tables of a range of pages with extract_page_data().
+
+    Args:
+        task (tuple): The path of the input PDF file, the index of the first page and the index after the last page.
+
+    Returns:
+        list: A (page text lines, tables) tuple per page, in page order.
+
+    The PDF is opened once for the whole range. Tables are returned as lists of rows rather than DataFrames, so that
+    little has to be sent back to the parent process.
+    """
+    input_file, start, stop = task
+    with PDFSession(input_file) as session:
+        return [extract_page_data(session, i) for i in range(start, stop)]
+
+
+def get_page_tables(data, page_idx, input_file):
+    """
+    Convert the raw tables extracted from one page into pandas DataFrames.
+
+    Args:
+        data (list or bool): The tables found by rotate_page() as lists of rows, or False.
+        page_idx (int): The index of the page within the PDF, for logging.
+        input_file (str): The path of the input PDF file, for logging.
+
+    Returns:
+        list: A list of pandas DataFrames, one per table which could be processed.
+
+    For each table:
+        a. Extracts the column names from the first row of the table.
+        b. Restructures the rows of the table using the `restructure_rows` function.
+        c. If there are missing row data, it raises a ValueError with a message.
+        d. If new headings are present, it appends them to the corresponding columns.
+        e. Constructs a pandas DataFrame using the rows and columns.
+    Tables which cannot be processed are logged and left out.
+    """
+    tables = []
+    if not data:
+        return tables
+    for table in data:
+        try:
+            # Extract column names from the first row
+            cols = [x for x in table[0]]
+            # Restructure rows and get new headings if available
+            rows, new_headings = restructure_rows(table[1:], len(table[0]))
+            # Raise an error if there are missing row data
+            if not rows:
+                raise ValueError("missing row data")
+            # Append new headings to the corresponding columns
+            if new_headings:
+                for h_idx, heading_row in enumerate(new_headings):
+                    for i in range(len(cols)):
+                        if i > h_idx:
+                            break
+                        if heading_row[i]:
+                            cols[i] = F"{cols[i]} | {heading_row[i]}"
+            # Create a pandas DataFrame using the rows and columns
+            df = pandas.DataFrame(rows, columns=cols)
+        except ValueError as ve:
+            logging.error(msg=F"Failed to process table on page {page_idx} of file: {input_file} due to:\n{ve}")
+            continue
+        except Exception as ex:
+            logging.error(msg=F"Failed to process file: {input_file} due to:\n{ex}")
+            continue
+        # Append the DataFrame to the tables list
+        tables.append(df)
+    return tables
+
+
+def iter_pdf_pages(input_file, pool=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Extract the page texts and tables of a PDF file one page at a time.
+
+    Args:
+        input_file (str): The path of the input PDF file.
+        pool (multiprocessing.Pool): Optional process pool to extract the pages in parallel.
+        pages_per_task (int): The number of consecutive pages each pool task extracts.
+
+    Yields:
+        tuple: The page text split into lines, and a list of pandas DataFrames for the tables on the page, in page order.
+
+    Each page's cached layout objects are released once the page is extracted (see extract_page_data()), and nothing
+    is kept after a page is yielded, so memory use does not grow with the number of pages.
+
+    With a pool, the pages are split into ranges of `pages_per_task` pages which the pool's processes extract in parallel,
+    each opening the PDF once per range. The extracted pages are yielded in page order, the same as without a pool.
+    """
+    logging.info(input_file)
+    if pool is None:
+        with PDFSession(input_file) as session:
+            for i in range(len(session.pages)):
+                page_text, data = extract_page_data(session, i)
+                yield page_text, get_page_tables(data, i, input_file)
+    else:
+        with PDFSession(input_file) as session:
+            page_count = len(session.pages)
+        tasks = [(input_file, x, min(x + pages_per_task, page_count)) for x in range(0, page_count, pages_per_task)]
+        # page ranges come back in submission order, so pages are yielded in document order
+        for task, pages in zip(tasks, pool.imap(extract_pages, tasks)):
+            for i, (page_text, data) in enumerate(pages, task[1]):
+                yield page_text, get_page_tables(data, i, input_file)
+
+
+def process_pdf(input_file, pool=None, pages_per_task=PAGES_PER_TASK):
     """
     Process a PDF file and extract tables and page texts.
 
     Args:
         input_file (str): The path of the input PDF file.
+        pool (multiprocessing.Pool): Optional process pool to extract the pages in parallel.
+        pages_per_task (int): The number of consecutive pages each pool task extracts.
 
     Returns:
         tuple: A tuple containing tables and page texts.
             - tables (list): A list of pandas DataFrames representing the extracted tables.
             - page_texts (list): A list of strings representing the extracted text from each page.
 
-    The function uses the `pdfplumber` library to open the input PDF file.
-
-    It iterates over each page in the PDF file and performs the following steps:
+    The pages are extracted by iter_pdf_pages(), which for each page:
     1. Extracts the text from the page using `page.extract_text()`.
     2. Splits the extracted text into lines using the newline character ('\n').
     3. Calls the `rotate_page` function to check if the page needs to be rotated and performs necessary rotations.
-    4. If the `rotate_page` function returns data, it iterates over each table in the data and performs the following:
-        a. Extracts the column names from the first row of the table.
-        b. Restructures the rows of the table using the `restructure_rows` function.
-        c. If there are missing row data, it raises a ValueError with a message.
-        d. If new headings are present, it appends them to the corresponding columns.
-        e. Constructs a pandas DataFrame using the rows and columns.
-    5. If any exception occurs during the table processing, it logs an error message and returns False for both tables and page texts.
+    4. Converts the tables `rotate_page` returns into pandas DataFrames with get_page_tables().
 
-    The extracted tables and page texts are appended to the `tables` and `page_texts` lists, respectively.
+    The extracted tables and page texts are appended to the `tables` and `page_texts` lists, respectively, so the
+    result of a whole PDF is held in memory. Use write_pdf_result() to write large PDFs out page by page instead.
 
     Finally, the function returns the `tables` and `page_texts` lists as a tuple.
     """
-    filename = input_file
-    pdf = pdfplumber.open(input_file)
-    logging.info(input_file)
     tables = []
     page_texts = []
     # Iterate over each page in the PDF file
-    for i, page in enumerate(pdf.pages):
-        # Extract text from the page and split into lines
-        page_text = page.extract_text()
-        page_text = page_text.split("\n")
-        # Check if the page needs rotation and perform necessary rotations
-        data = rotate_page(input_file, i)
-        if data:
-            for table in data:
-                try:
-                    # Extract column names from the first row
-                    cols = [x for x in table[0]]
-                    # Restructure rows and get new headings if available
-                    rows, new_headings = restructure_rows(table[1:], len(table[0]))
-                    # Raise an error if there are missing row data
-                    if not rows:
-                        raise ValueError("missing row data")
-                    # Append new headings to the corresponding columns
-                    if new_headings:
-                        for h_idx, heading_row in enumerate(new_headings):
-                            for i in range(len(cols)):
-                                if i > h_idx:
-                                    break
-                                if heading_row[i]:
-                                    cols[i] = F"{cols[i]} | {heading_row[i]}"
-                    # Create a pandas DataFrame using the rows and columns
-                    df = pandas.DataFrame(rows, columns=cols)
-                except ValueError as ve:
-                    logging.error(msg=F"Failed to process table on page {i} of file: {input_file} due to:\n{ve}")
-                    continue
-                except Exception as ex:
-                    logging.error(msg=F"Failed to process file: {input_file} due to:\n{ex}")
-                    continue
-                # Append the DataFrame to the tables list
-                tables.append(df)
+    for page_text, page_tables in iter_pdf_pages(input_file, pool, pages_per_task):
+        tables.extend(page_tables)
         # Append the page text to the page_texts list
         page_texts.append(page_text)
     # Return the tables and page_texts as a tuple
     return tables, page_texts
 
 
+def write_pdf_result(input_file, text_fp, tables_fp, pool=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Extract the page texts and tables of a PDF file and write them out as BioC JSON one page at a time.
+
+    Args:
+        input_file (str): The path of the input PDF file.
+        text_fp: Text file handle the BioC text collection is written to.
+        tables_fp: Text file handle the BioC tables collection is written to.
+        pool (multiprocessing.Pool): Optional process pool to extract the pages in parallel.
+        pages_per_task (int): The number of consecutive pages each pool task extracts.
+
+    Returns:
+        int: The number of tables written.
+
+    The output is identical to dumping the collections convert_pdf_result() builds from process_pdf(), the text with
+    bioc's biocjson.dump() and the tables with json.dump(indent=4), but each page's text passage and tables are written
+    as soon as the page is extracted, so memory use stays flat however many pages the PDF has.
+    """
+    with BiocPassageWriter(get_text_bioc([], input_file), text_fp, ensure_ascii=True) as text_out, \
+            BiocPassageWriter(get_tables_bioc([], input_file), tables_fp, indent=4, ensure_ascii=True) as tables_out:
+        for page_text, page_tables in iter_pdf_pages(input_file, pool, pages_per_task):
+            text_out.write(BioCText(replace_unicode(page_text)).__dict__)
+            for table in page_tables:
+                # tables are numbered through the whole PDF, as by get_tables_bioc()
+                tables_out.write(BioCTable(tables_out.passage_count + 1, table).__dict__)
+        return tables_out.passage_count
+
+
 def replace_unicode(text):
     """
     Replaces specific Unicode characters with their corresponding replacements in the given text.
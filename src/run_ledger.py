@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+
+class RunLedger:
+    """
+    Append-only JSONL record of per-article outcomes kept in the target directory.
+    Each line is written as soon as an article finishes, so an interrupted batch can be resumed
+    by skipping articles which already completed with the same inputs, config and output settings and whose output
+    files are still in place.
+    """
+    FILE_NAME = "autoCORPus-ledger.jsonl"
+
+    def __init__(self, target_dir: str) -> None:
+        self.path = os.path.join(target_dir, self.FILE_NAME)
+        self.entries = self.__load()
+
+    def __load(self) -> dict:
+        """
+        Read the existing ledger, keeping the latest entry for each article key.
+
+        Returns:
+            dict of article key to ledger entry
+        """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # partial line left behind by a crash mid-write
+                    continue
+                entries[entry["key"]] = entry
+        return entries
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        if not file_path or not os.path.isfile(file_path):
+            return ""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_inputs(article: dict) -> dict:
+        """
+        Hash every input file of an article group.
+
+        Args:
+            article: structure dict entry for the group (main_text, linked_tables, table_images, supplementary_files)
+
+        Returns:
+            dict of file path to content hash
+        """
+        paths = [article["main_text"]] if article["main_text"] else []
+        for ftype in ["linked_tables", "table_images", "supplementary_files"]:
+            paths.extend(sorted(article.get(ftype, [])))
+        return {path: RunLedger.hash_file(path) for path in paths}
+
+    @staticmethod
+    def get_settings(output_format: str, html_parser: str, max_table_span: int, max_table_cells: int) -> dict:
+        """
+        Run options which change the outputs written for an article, recorded alongside the config hash.
+        """
+        return {
+            "output_format": output_format.lower(),
+            "html_parser": html_parser,
+            "max_table_span": max_table_span,
+            "max_table_cells": max_table_cells
+        }
+
+    def is_complete(self, key: str, inputs: dict, config_hash: str, settings: dict) -> bool:
+        """
+        Whether the article already completed with the same inputs, config and settings, and its outputs still exist.
+        """
+        entry = self.entries.get(key)
+        if not entry:
+            return False
+        return entry["outcome"] == "success" and entry["inputs"] == inputs and entry["config"] == config_hash and \
+            entry.get("settings") == settings and all(os.path.isfile(x) for x in entry.get("outputs", []))
+
+    def record(self, key: str, inputs: dict, config_hash: str, settings: dict, outcome: str, message: str,
+               outputs: list = None) -> None:
+        entry = {
+            "key": key,
+            "inputs": inputs,
+            "config": config_hash,
+            "settings": settings,
+            "outcome": outcome,
+            "message": message,
+            "outputs": outputs or [],
+            "date": datetime.now().isoformat(timespec="seconds")
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.entries[key] = entry
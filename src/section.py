@@ -1,6 +1,6 @@
 import nltk
-from fuzzywuzzy import fuzz
 
+from src.iao_lexicon import IAOHeadingCache
 from src.references import References
 from src.utils import *
 
@@ -15,15 +15,23 @@ class Section:
             "section_type": self.section_type
         })
 
-    def __navigate_children(self, soup_section, all_sub_sections, filtered_paragraphs):
-        if soup_section in filtered_paragraphs:
+    def __navigate_children(self, soup_section, sub_section_index, paragraph_ids):
+        """
+        Walk the section tree adding each paragraph with the subsection header in effect.
+
+        Args:
+            soup_section: current node
+            sub_section_index: dict of id(node) to sub-section match, the last match for a node wins
+            paragraph_ids: set of id(node) for the wanted paragraphs
+        """
+        if id(soup_section) in paragraph_ids:
             if soup_section.previous_sibling and soup_section.previous_sibling.name in ("h3", "h4", "h5"):
                 self.subheader = soup_section.previous_sibling.get_text()
             self.__add_paragraph(soup_section.get_text())
             return
-        for subsec in all_sub_sections:
-            if subsec['node'] == soup_section:
-                self.subheader = subsec['headers'][0] if "headers" in subsec and not subsec['headers'] == "" else ""
+        subsec = sub_section_index.get(id(soup_section))
+        if subsec:
+            self.subheader = subsec['headers'][0] if "headers" in subsec and not subsec['headers'] == "" else ""
         # elif soup_section in subsecNodes:
         # 	self.subheader = self.__get_subsection_header(soup_section)
         try:
@@ -32,7 +40,7 @@ class Section:
             print(e)
             children = []
         for child in children:
-            self.__navigate_children(child, all_sub_sections, filtered_paragraphs)
+            self.__navigate_children(child, sub_section_index, paragraph_ids)
 
     def __get_abbreviations(self, soup_section):
         if "abbreviations-Table" in self.config:
@@ -48,7 +56,15 @@ class Section:
             self.__add_paragraph(str(abbreviations))
 
     def __set_iao(self):
-        mapping_dict = read_mapping_file()
+        cache = IAOHeadingCache.get()
+        cached = cache.get_section_type(self.section_heading)
+        if cached is not None:
+            self.section_type = cached
+            return
+        self.section_type = self.__map_iao(cache.lexicon)
+        cache.put_section_type(self.section_heading, self.section_type)
+
+    def __map_iao(self, lexicon):
         tokenized_section_heading = nltk.wordpunct_tokenize(self.section_heading)
         text = nltk.Text(tokenized_section_heading)
         words = [w.lower() for w in text]
@@ -62,39 +78,29 @@ class Section:
                 h2_parts = re.split(r" and |\s?/\s?|\s?&\s?", h2_tmp)
                 for h2_part in h2_parts:
                     h2_part = re.sub(r"^\d*\s?[(.]]?\s?", "", h2_part)
-                    pass
-                    for IAO_term, heading_list in mapping_dict.items():
-                        if any([fuzz.ratio(h2_part, heading) >= 80 for heading in heading_list]):
-                            mapping_result.append(self.__add_iao(IAO_term))
-                            break
+                    iao_term = lexicon.match_term(h2_part)
+                    if iao_term:
+                        mapping_result.append(lexicon.to_iao(iao_term))
 
             else:
-                for IAO_term, heading_list in mapping_dict.items():
-                    h2_tmp = re.sub(r"^\d*\s?[(.]]?\s?", "", h2_tmp)
-                    if any([fuzz.ratio(h2_tmp, heading) > 80 for heading in heading_list]):
-                        mapping_result = [self.__add_iao(IAO_term)]
+                # the numbering prefix is stripped again before each IAO term is compared, so headings with several
+                # prefixes (e.g. "2 1 methods") are compared against later terms with more of them removed
+                term_idx = 0
+                h2_tmp = re.sub(r"^\d*\s?[(.]]?\s?", "", h2_tmp)
+                while True:
+                    next_h2_tmp = re.sub(r"^\d*\s?[(.]]?\s?", "", h2_tmp)
+                    if next_h2_tmp == h2_tmp:
+                        iao_term = lexicon.match_term(h2_tmp, strict=True, start=term_idx)
+                        break
+                    iao_term = lexicon.match_term(h2_tmp, strict=True, start=term_idx, stop=term_idx + 1)
+                    if iao_term or term_idx >= len(lexicon.terms):
                         break
-                    else:
-                        mapping_result = []
+                    h2_tmp = next_h2_tmp
+                    term_idx += 1
+                mapping_result = [lexicon.to_iao(iao_term)] if iao_term else []
         else:
             mapping_result = []
-        self.section_type = mapping_result
-
-    def __add_iao(self, iao_term):
-        paper = {}
-        iao_term = iao_term
-        paper.update({self.section_heading: iao_term})
-
-        # map IAO terms to IAO IDs
-        iao_term_to_no_dict = read_iao_term_to_id_file()
-        if iao_term in iao_term_to_no_dict.keys():
-            mapping_result_id_version = iao_term_to_no_dict[iao_term]
-        else:
-            mapping_result_id_version = ''
-        return {
-            "iao_name": iao_term,
-            "iao_id": mapping_result_id_version
-        }
+        return mapping_result
 
     def __get_section(self, soup_section):
 
@@ -105,13 +111,15 @@ class Section:
         all_tables = [x['node'] for x in all_tables]
         all_figures = handle_not_tables(self.config['figures'], soup_section)
         all_figures = [x['node'] for x in all_figures]
-        unwanted_paragraphs = []
-        [unwanted_paragraphs.extend(capt.find_all("p", recursive=True)) for capt in all_tables]
-        [unwanted_paragraphs.extend(capt.find_all("p", recursive=True)) for capt in all_figures]
-        all_paragraphs = [para for para in all_paragraphs if para not in unwanted_paragraphs]
+        # bs4 compares tags by their whole subtree, so membership is tracked by node identity instead
+        unwanted_paragraphs = set()
+        for capt in all_tables + all_figures:
+            unwanted_paragraphs.update(id(x) for x in capt.find_all("p", recursive=True))
+        paragraph_ids = {id(para) for para in all_paragraphs if id(para) not in unwanted_paragraphs}
+        sub_section_index = {id(subsec['node']): subsec for subsec in all_sub_sections}
         children = soup_section.findChildren(recursive=False)
         for child in children:
-            self.__navigate_children(child, all_sub_sections, all_paragraphs)
+            self.__navigate_children(child, sub_section_index, paragraph_ids)
 
     def __get_references(self, soup_section: object):
         """
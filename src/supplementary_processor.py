@@ -1,10 +1,8 @@
 import json
 import os.path
 
-from bioc import biocjson
-
 from file_extension_analysis import get_file_extensions
-from pdf_extractor import process_pdf, convert_pdf_result
+from pdf_extractor import write_pdf_result
 from word_extractor import process_word_document
 from excel_extractor import process_spreadsheet, get_tables_bioc
 
@@ -47,7 +45,7 @@ def __extract_word_data(locations=None, file=None):
         process_word_document(file)
 
 
-def __extract_pdf_data(locations=None, file=None):
+def __extract_pdf_data(locations=None, file=None, pool=None):
     """
     Extracts data from PDF documents located at the given file locations.
 
@@ -57,6 +55,8 @@ def __extract_pdf_data(locations=None, file=None):
             are dictionaries with the following structure:
                 - 'total' (int): The total count of PDF documents with the extension.
                 - 'locations' (list): A list of paths to the locations of PDF documents.
+        file (str): A string containing a PDF file path to process.
+        pool (multiprocessing.Pool): Optional process pool to extract the pages of each PDF in parallel.
 
     Returns:
         None
@@ -66,29 +66,40 @@ def __extract_pdf_data(locations=None, file=None):
         pdf_locations = locations[".pdf"]["locations"]
         # Iterate over the file locations of PDF documents
         for x in pdf_locations:
-            base_dir, file_name = os.path.split(x)
-            # Process the PDF document using a custom pdf_extractor
-            tables, text = process_pdf(x)
-            text, tables = convert_pdf_result(tables, text, x)
-            # Write the extracted tables & texts to JSON files
-            if tables:
-                with open(F"{os.path.join(base_dir, file_name + '_tables.json')}", "w", encoding="utf-8") as tables_out:
-                    json.dump(tables, tables_out, indent=4)
-            if text:
-                with open(F"{os.path.join(base_dir, file_name + '_tables.json')}", "w", encoding="utf-8") as text_out:
-                    biocjson.dump(text, text_out)
+            __write_pdf_data(x, pool)
     if file:
-        base_dir, file_name = os.path.split(file)
-        # Process the PDF document using a custom pdf_extractor
-        tables, text = process_pdf(file)
-        # Write the extracted tables to a JSON file
-        text, tables = convert_pdf_result(tables, text, file)
-        if tables:
-            with open(F"{os.path.join(base_dir, file_name + '_tables.json')}", "w", encoding="utf-8") as tables_out:
-                json.dump(tables, tables_out, indent=4)
-        if text:
-            with open(F"{os.path.join(base_dir, file_name + '_bioc.json')}", "w", encoding="utf-8") as text_out:
-                biocjson.dump(text, text_out)
+        __write_pdf_data(file, pool)
+
+
+def __write_pdf_data(file, pool=None):
+    """
+    Extracts the text and tables of a PDF document and writes them to BioC JSON files next to it, page by page.
+
+    Args:
+        file (str): A string containing a PDF file path to process.
+        pool (multiprocessing.Pool): Optional process pool to extract the pages in parallel.
+
+    Returns:
+        None
+
+    """
+    base_dir, file_name = os.path.split(file)
+    tables_path = os.path.join(base_dir, file_name + '_tables.json')
+    text_path = os.path.join(base_dir, file_name + '_bioc.json')
+    # The files are written under temporary names in the same directory and only replace any previous output once the
+    # whole PDF has been written, so a failure partway through leaves no truncated JSON behind
+    tables_tmp, text_tmp = F"{tables_path}.{os.getpid()}.tmp", F"{text_path}.{os.getpid()}.tmp"
+    try:
+        # Process the PDF document using a custom pdf_extractor, writing the extracted tables & texts to JSON files
+        with open(tables_tmp, "w", encoding="utf-8") as tables_out, open(text_tmp, "w", encoding="utf-8") as text_out:
+            write_pdf_result(file, text_out, tables_out, pool)
+        os.replace(tables_tmp, tables_path)
+        os.replace(text_tmp, text_path)
+    except BaseException:
+        for path in [tables_tmp, text_tmp]:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
 
 
 def __extract_spreadsheet_data(locations=None, file=None):
@@ -135,12 +146,13 @@ def __extract_spreadsheet_data(locations=None, file=None):
                 json.dump(json_output, f_out, indent=4)
 
 
-def process_supplementary_files(supplementary_files, output_format='json'):
+def process_supplementary_files(supplementary_files, output_format='json', pool=None):
     """
     Processes input list of file paths as supplementary data.
 
     Args:
         supplementary_files (list): List of file paths
+        pool (multiprocessing.Pool): Optional process pool to extract the pages of PDF files in parallel
     """
     for file in supplementary_files:
         if not os.path.exists(file) or os.path.isdir(file):
@@ -152,7 +164,7 @@ def process_supplementary_files(supplementary_files, output_format='json'):
 
         # Extract data from PDF files if they are present
         elif file.lower().endswith("pdf"):
-            __extract_pdf_data(file=file)
+            __extract_pdf_data(file=file, pool=pool)
 
         # Extract data from spreadsheet files if they are present
         elif [1 for x in spreadsheet_extensions if file.lower().endswith(x)]:
@@ -1,36 +1,58 @@
-import json
-import re
+import logging
 from datetime import datetime
-from itertools import product
 from pathlib import Path
 from typing import List, Optional, Union
 
+import numpy as np
 from bs4 import BeautifulSoup
 
-from src.utils import is_mixed_data_type, is_text, is_number, handle_tables, get_data_element_node, navigate_contents
+from src.cell_normalisation import normalise_cell, PVAL_REGEX, PVAL_SCIENTIFIC_REGEX
+from src.utils import is_number, handle_tables, get_data_element_node
+
+log = logging.getLogger(__name__)
+# warnings about malformed tables are kept when another module sets the root logger to ERROR
+log.setLevel(logging.WARNING)
 
 
 class TableParser:
     """
     Public interface class for table construction
     """
-
-    def __init__(self, config: dict):
+    CELL_BLANK, CELL_NUMBER, CELL_MIXED, CELL_TEXT, CELL_OTHER = range(5)
+    ASCII_DIGITS = str.maketrans("", "", "0123456789")
+    # limits protecting against malformed tables, e.g. colspan="100000". Tables are expanded into a dense grid, as every
+    # cell a span covers repeats its value in the output, so the grid size is what bounds memory and time
+    MAX_SPAN = 1000
+    MAX_GRID_CELLS = 5000000
+
+    def __init__(self, config: dict, max_span: int = MAX_SPAN, max_grid_cells: int = MAX_GRID_CELLS, pool=None):
+        """
+        Args:
+            config: loaded (or compiled) config with a tables definition
+            max_span: largest rowspan/colspan honoured, larger spans are reduced to it
+            max_grid_cells: largest number of grid cells a table may expand to, larger tables are skipped
+            pool: optional multiprocessing pool, tables of a document are then parsed in parallel
+        """
         self.__header_idx: list = []
         self.__superrow_idx: list = []
         self.__subheader_idx: list = []
         self.__table_2d: list = []
+        self.__first_col_varies = None
         self.config = config
         self.soup_tables = None
         self.is_parsed = False
         self.file_name = ""
         self.row_size = 0
+        self.max_span = max_span
+        self.max_grid_cells = max_grid_cells
+        self.pool = pool
 
     def reset_parsed_state(self):
         self.__header_idx: list = []
         self.__superrow_idx: list = []
         self.__subheader_idx: list = []
         self.__table_2d: list = []
+        self.__first_col_varies = None
         self.soup_tables = False
         self.is_parsed = False
         self.file_name = ""
@@ -38,11 +60,11 @@ class TableParser:
 
     @staticmethod
     def get_pval_regex() -> str:
-        return r'((\d+\.\d+)|(\d+))(\s?)[*××xX](\s{0,1})10[_]{0,1}([–−-])(\d+)'
+        return PVAL_REGEX
 
     @staticmethod
     def get_pval_scientific_regex() -> str:
-        return r'((\d+.\d+)|(\d+))(\s{0,1})[eE](\s{0,1})([–−-])(\s{0,1})(\d+)'
+        return PVAL_SCIENTIFIC_REGEX
 
     def __get_empty_tables(self) -> tuple:
         pop_list = []
@@ -59,12 +81,22 @@ class TableParser:
 
         return pop_list, empty_tables
 
-    def __contains_superrow(self, row: list) -> bool:
-        first_col = [row[0] for row in self.__table_2d]
-        first_col_vals = [i for i in first_col if first_col.index(i) not in self.__header_idx]
-        unique_vals = TableParser.get_unique_values(first_col_vals)
+    def __first_column_varies(self) -> bool:
+        """
+        Whether the first column holds more than one distinct value, ignoring values first seen in a header row.
+        Only depends on the table, so it is worked out once per table on first use.
+        """
+        if self.__first_col_varies is None:
+            header_idx = set(self.__header_idx)
+            first_seen = {}
+            for row_idx, row in enumerate(self.__table_2d):
+                first_seen.setdefault(row[0], row_idx)
+            first_col_vals = [i for i, row_idx in first_seen.items() if row_idx not in header_idx]
+            self.__first_col_varies = len(TableParser.get_unique_values(first_col_vals)) > 1
+        return self.__first_col_varies
 
-        if len(unique_vals) > 1:
+    def __contains_superrow(self, row: list) -> bool:
+        if self.__first_column_varies():
             # iterate through unique cell indexes
             cell_count = len(row[1:])
             blank_cell_count = 0
@@ -137,14 +169,21 @@ class TableParser:
         # fill colspan and rowspan
         for row in rows:
             for col in row.findAll(['th', 'td']):
-                if 'colspan' not in col.attrs:
-                    col.attrs['colspan'] = 1
-                if 'rowspan' not in col.attrs:
-                    col.attrs['rowspan'] = 1
+                for span in ['colspan', 'rowspan']:
+                    if span not in col.attrs:
+                        col.attrs[span] = 1
+                    elif int(col.attrs[span]) > self.max_span:
+                        log.warning(F"{self.file_name}: {span} of {col.attrs[span]} reduced to {self.max_span}")
+                        col.attrs[span] = self.max_span
 
         # first scan, see how many columns we need
         n_cols = sum([int(i.attrs['colspan']) for i in t.find('tr').findAll(['th', 'td'])])
         self.row_size = n_cols
+        if len(rows) * n_cols > self.max_grid_cells:
+            log.warning(F"{self.file_name}: skipped a table of {len(rows)} rows by {n_cols} columns, "
+                        F"more than {self.max_grid_cells} cells")
+            self.__table_2d = []
+            return
         # build an empty matrix for all possible cells
         table = []
         for i in range(len(rows)):
@@ -170,43 +209,20 @@ class TableParser:
                 # next column is offset by the colspan
                 span_offset += colspan - 1
 
-                c_cont = cell.contents
-                value = ""
-                for item in c_cont:
-                    value += navigate_contents(item)
-
-                # clean the cell
-                value = value.strip().replace('\u2009', ' ').replace("&#x000a0;", " ")
-                value = re.sub(r"\s", " ", value)
-                value = re.sub(r"</?span[^>\n]*>?|<hr/>?", "", value)
-                value = re.sub(r"\n", "", value)
-                if value.startswith('(') and value.endswith(')'):
-                    value = value[1:-1]
-                if re.match(TableParser.get_pval_regex(), value):
-                    value = re.sub(r'(\s?)[*×xX](\s?)10(_?)', 'e', value).replace('−', '-')
-                if re.match(TableParser.get_pval_scientific_regex(), value):
-                    value = re.sub(r'(\s?)[–−-](\s?)', '-', value)
-                    value = re.sub(r'(\s?)[eE]', 'e', value)
-                for drow, dcol in product(range(rowspan), range(colspan)):
-                    try:
+                value = normalise_cell(cell)
+                # rowspan or colspan outside the confines of the Table is ignored
+                for drow in range(min(rowspan, len(rows) - row_idx)):
+                    for dcol in range(min(colspan, n_cols - col_idx)):
                         table[row_idx + drow][col_idx + dcol] = value
                         rowspans[col_idx + dcol] = rowspan
-                    except IndexError:
-                        # rowspan or colspan outside the confines of the Table
-                        pass
             # update rowspan bookkeeping
             rowspans = {c: s - 1 for c, s in rowspans.items() if s > 1}
         self.__table_2d = table
 
     def __get_superrows(self) -> list:
-        superrow_list = []
-        if self.__table_2d:
-            for row_idx in range(len(self.__table_2d)):
-                row = self.__table_2d[row_idx]
-                if row_idx not in self.__header_idx:
-                    if self.__contains_superrow(row):
-                        superrow_list.append(row_idx)
-        return superrow_list
+        header_idx = set(self.__header_idx)
+        return [row_idx for row_idx, row in enumerate(self.__table_2d)
+                if row_idx not in header_idx and self.__contains_superrow(row)]
 
     @staticmethod
     def is_empty_table(table_soup: BeautifulSoup) -> bool:
@@ -217,39 +233,63 @@ class TableParser:
                 return False
         return True
 
+    @staticmethod
+    def __classify_cell(cell: str) -> tuple:
+        """
+        Equivalent to checking the cell with is_number, is_mixed_data_type and is_text, but finds its digits once.
+
+        Returns:
+            cell type code used to infer column types, whether the cell counts as text in a non text column
+        """
+        cell = str(cell).lower()
+        if cell.isascii():
+            non_digits = cell.translate(TableParser.ASCII_DIGITS)
+        else:
+            non_digits = "".join(char for char in cell if not char.isdigit())
+        has_digit = len(non_digits) < len(cell)
+        if cell in ['none', '', '-']:
+            cell_type = TableParser.CELL_BLANK
+        elif is_number(cell):
+            cell_type = TableParser.CELL_NUMBER
+        elif has_digit and non_digits:
+            cell_type = TableParser.CELL_MIXED
+        elif not has_digit:
+            cell_type = TableParser.CELL_TEXT
+        else:
+            cell_type = TableParser.CELL_OTHER
+        return cell_type, not has_digit and cell not in ['none', '', '-', 'na']
+
+    @staticmethod
+    def __classify_cells(table_2d: list) -> tuple:
+        """
+        Classify each distinct cell value once and map the results back onto the table.
+
+        Returns:
+            array of cell type codes and array of text flags, both shaped like the table
+        """
+        value_idx = {}
+        cells = np.array([value_idx.setdefault(cell, len(value_idx)) for row in table_2d for cell in row],
+                         dtype=np.intp).reshape((len(table_2d), len(table_2d[1])))
+        classified = [TableParser.__classify_cell(value) for value in value_idx]
+        cell_types = np.array([x[0] for x in classified], dtype=np.int8)[cells]
+        text_cells = np.array([x[1] for x in classified], dtype=bool)[cells]
+        return cell_types, text_cells
+
     def __get_subheaders(self, table_2d: list) -> None:
-        value_idx = [i for i in range(len(table_2d)) if i not in self.__header_idx + self.__superrow_idx]
-        col_type = []
-        for col_idx in range(len(table_2d[1])):  # Ignore header row (0 index) length
-            cur_col = [i[col_idx] for i in table_2d]
-            num_cnt = 0
-            txt_cnt = 0
-            mix_cnt = 0
-            for cell in cur_col:
-                cell = str(cell).lower()
-                if cell in ['none', '', '-']:
-                    continue
-                elif is_number(cell):
-                    num_cnt += 1
-                elif is_mixed_data_type(cell):
-                    mix_cnt += 1
-                elif is_text(cell):
-                    txt_cnt += 1
-            if max(num_cnt, txt_cnt, mix_cnt) == num_cnt:
-                col_type.append('num')
-            elif max(num_cnt, txt_cnt, mix_cnt) == txt_cnt:
-                col_type.append('txt')
-            else:
-                col_type.append('mix')
+        labelled_idx = set(self.__header_idx + self.__superrow_idx)
+        value_idx = [i for i in range(len(table_2d)) if i not in labelled_idx]
+        cell_types, text_cells = self.__classify_cells(table_2d)
+        num_cnt = (cell_types == TableParser.CELL_NUMBER).sum(axis=0)
+        txt_cnt = (cell_types == TableParser.CELL_TEXT).sum(axis=0)
+        mix_cnt = (cell_types == TableParser.CELL_MIXED).sum(axis=0)
+        # ties go to numeric, then text columns
+        max_cnt = np.maximum(np.maximum(num_cnt, txt_cnt), mix_cnt)
+        txt_cols = (num_cnt != max_cnt) & (txt_cnt == max_cnt)
+        unmatch_cnt = (text_cells & ~txt_cols).sum(axis=1)
         self.__subheader_idx = []
         for row_idx in value_idx:
             cur_row = table_2d[row_idx]
-            unmatch_cnt = 0
-            for col_idx in range(len(cur_row)):
-                cell = str(cur_row[col_idx]).lower()
-                if is_text(cell) and col_type[col_idx] != 'txt' and cell not in ['none', '', '-', 'na']:
-                    unmatch_cnt += 1
-            if unmatch_cnt >= len(cur_row) / 2 or self.__contains_superrow(cur_row):
+            if unmatch_cnt[row_idx] >= len(cur_row) / 2 or self.__contains_superrow(cur_row):
                 self.__subheader_idx.append(row_idx)
         self.__header_idx += self.__subheader_idx
         self.__subheader_idx = []
@@ -313,7 +353,52 @@ class TableParser:
         if not table:
             return []
 
+        return TableParser.parse_table(self.config, self.file_name, table_idx, table, title, caption, footer,
+                                       self.max_span, self.max_grid_cells)
+
+    def __parse_tables(self, soup_tables: list) -> list:
+        """
+        Parse the tables of a document in order, fanning them out to the process pool if there is one.
+        """
+        if self.pool is None or len(soup_tables) < 2:
+            return [self.__parse_table(i + 1, soup_tables[i]) for i in range(len(soup_tables))]
+        tasks = []
+        for i in range(len(soup_tables)):
+            # pre-processing edits the document, so it stays in this process
+            table, title, caption, footer = self.__pre_process_table(soup_tables[i])
+            # the soup cannot be sent to another process, tables are detached from it as HTML
+            tasks.append(({"tables": self.config["tables"]}, self.file_name, i + 1, str(table) if table else None,
+                          title, caption, footer, self.max_span, self.max_grid_cells))
+        return self.pool.map(parse_table_fragment, tasks, chunksize=1)
+
+    @staticmethod
+    def parse_table(config: dict, file_name: str, table_idx: int, table: BeautifulSoup, title: str, caption: str,
+                    footer: str, max_span: int = MAX_SPAN, max_grid_cells: int = MAX_GRID_CELLS) -> list:
+        """
+        Parse one pre-processed table element into Table objects.
+        Each call works on a parser of its own, so tables share no state and can be parsed in other processes.
+
+        Args:
+            config: config with a tables definition
+            file_name: resolved path of the file the table comes from
+            table_idx: 1-based number of the table within the file
+            table: table element matched by the tables definition
+            title: title text of the table
+            caption: caption text of the table
+            footer: footer text of the table
+            max_span: see TableParser
+            max_grid_cells: see TableParser
+
+        Returns:
+            list of Table objects, the table is split at repeated headers
+        """
+        parser = TableParser(config, max_span, max_grid_cells)
+        parser.file_name = file_name
+        return parser.__parse_table_node(table_idx, table, title, caption, footer)
+
+    def __parse_table_node(self, table_idx: int, table: BeautifulSoup, title: str, caption: str, footer: str) -> list:
         self.__header_idx = self.__get_headers(table)
+        self.__first_col_varies = None
 
         # span Table to single-cells
         self.__table_to_2d(table)
@@ -353,17 +438,18 @@ class TableParser:
                 }
                 empty_tables.append(et_dict)
         del temp_empty_tables
-        table_docs: list = [self.__parse_table(i + 1, soup_tables[i]) for i in range(len(soup_tables))]
+        table_docs: list = self.__parse_tables(soup_tables)
         # Flatten structure to a single list for output
         table_docs = [x for y in table_docs for x in y]
         current_datetime = f'{datetime.today().strftime("%Y%m%d")}'
         output_tables = TableBioc("Auto-CORPus (tables)", current_datetime, "autocorpus_tables.key", {}, table_docs)
-        output_tables = json.loads(json.dumps(output_tables, default=complex_handler))
+        output_tables = output_tables.get_dict()
         self.reset_parsed_state()
         return output_tables, empty_tables
 
 
 class TableBioc:
+    __slots__ = ("source", "date", "key", "infons", "documents")
 
     def __init__(self, source: str, date: str, key: str, infons: dict, documents: list) -> None:
         if documents is None:
@@ -387,17 +473,23 @@ class TableBioc:
         return new_docs
 
     def get_dict(self) -> dict:
-        return self.__dict__
+        return {
+            "source": self.source,
+            "date": self.date,
+            "key": self.key,
+            "infons": self.infons,
+            "documents": [x.get_dict() for x in self.documents]
+        }
 
 
 class Table:
+    __slots__ = ("inputfile", "id", "infons", "passages", "content_passage", "__offset")
 
     def __init__(self, identifier: str, file_path: str, passages: list = None) -> None:
         if passages is None:
             passages = []
         self.inputfile: str = file_path
         self.id = identifier
-        self.__table_2d: List[list] = []
         self.infons: Optional[Infons, dict] = {}
         self.passages: Optional[List[TablePassage]] = passages
         self.content_passage: Optional[TableContentPassage] = None
@@ -422,14 +514,12 @@ class Table:
         return new_data_section
 
     def get_dict(self) -> dict:
-        output = self.__dict__
-        if "_Table__table_2d" in output.keys():
-            del output["_Table__table_2d"]
-        if "content_passage" in output.keys():
-            del output["content_passage"]
-        if "_Table__offset" in output.keys():
-            del output["_Table__offset"]
-        return output
+        return {
+            "inputfile": self.inputfile,
+            "id": self.id,
+            "infons": self.infons,
+            "passages": [x.get_dict() for x in self.passages]
+        }
 
     @staticmethod
     def __create_headers(headings: list, table_ident: int) -> 'TableRow':
@@ -460,7 +550,7 @@ class Table:
                     continue
                 new_cell_content += str(headings[r_idx][col_idx]) + sep
             new_cell_content = new_cell_content.rstrip(sep)
-            new_cell = TableCell(new_cell_content, F"{table_ident}.1.{col_idx + 1}")
+            new_cell = TableCell(new_cell_content, table_ident, 1, col_idx + 1)
             new_header.cells.append(new_cell)
         return new_header
 
@@ -476,7 +566,7 @@ class Table:
         Returns:
             row_obj: TableRow object constructed from input data.
         """
-        cell_objs = [TableCell(row[x], F"{table_ident}.{row_idx}.{x + 1}") for x in range(len(row))]
+        cell_objs = [TableCell(row[x], table_ident, row_idx, x + 1) for x in range(len(row))]
         row_obj = TableRow(cell_objs)
         return row_obj
 
@@ -592,6 +682,7 @@ class Table:
 
 
 class TablePassage:
+    __slots__ = ("offset", "infons", "text", "passage_text_length", "annotations", "relations")
 
     def __init__(self, offset: int, infons_type: int, text: str) -> None:
         self.offset: int = offset
@@ -603,16 +694,20 @@ class TablePassage:
 
     def get_dict(self) -> dict:
         # Remove undesired outputs for BioC
-        output = self.__dict__
-        if "passage_text_length" in output.keys():
-            del output["passage_text_length"]
-        if "text" in output.keys():
-            if not output["text"]:
-                del output["text"]
+        output = {
+            "offset": self.offset,
+            "infons": self.infons.get_dict()
+        }
+        if self.text:
+            output["text"] = self.text
+        output["annotations"] = self.annotations
+        output["relations"] = self.relations
         return output
 
 
 class TableContentPassage(TablePassage):
+    __slots__ = ("column_headings", "data_section")
+
     def __init__(self, offset: int, column_headings: 'TableRow', data_section: list = None) -> None:
         super().__init__(offset, Infons.TYPE_SECTION, "")
         if data_section is None:
@@ -637,17 +732,15 @@ class TableContentPassage(TablePassage):
         self.data_section.append(data_section)
 
     def get_dict(self) -> dict:
-        # Remove undesired outputs for BioC
-        output = self.__dict__
-        if "passage_text_length" in output.keys():
-            del output["passage_text_length"]
-        if "text" in output.keys():
-            if not output["text"]:
-                del output["text"]
+        output = super().get_dict()
+        output["column_headings"] = self.column_headings.get_dict()
+        output["data_section"] = [x.get_dict() for x in self.data_section]
         return output
 
 
 class TableDataSection(TablePassage):
+    __slots__ = ("data_rows", "section_text_length")
+
     def __init__(self, data_rows: list or 'TableRow', offset: int, infons_type: int, text: str) -> None:
         super().__init__(offset, infons_type, text)
         if type(data_rows) is TableRow:
@@ -664,36 +757,49 @@ class TableDataSection(TablePassage):
         return length
 
     def get_dict(self) -> dict:
-        output = self.__dict__
-        if "section_text_length" in output.keys():
-            del output["section_text_length"]
-        if "passage_text_length" in output.keys():
-            del output["passage_text_length"]
-        if "text" in output.keys():
-            if not output["text"]:
-                del output["text"]
-                del output["infons"]
-                del output["offset"]
+        # untitled sections are written without their offset and infons
+        if self.text:
+            output = super().get_dict()
+        else:
+            output = {
+                "annotations": self.annotations,
+                "relations": self.relations
+            }
+        output["data_rows"] = [x.get_dict() for x in self.data_rows]
         return output
 
 
 class TableRow:
+    __slots__ = ("cells",)
+
     def __init__(self, cells: list = None) -> None:
         if cells is None:
             cells = []
         self.cells = cells
 
     def get_dict(self) -> list:
-        return self.cells
+        return [x.get_dict() for x in self.cells]
 
 
 class TableCell:
-    def __init__(self, text: str, cell_id: str) -> None:
-        self.cell_id = cell_id
+    # the cell id is only formatted on output, tables can hold a very large number of cells
+    __slots__ = ("cell_text", "table_ident", "row_idx", "col_idx")
+
+    def __init__(self, text: str, table_ident: int, row_idx: int, col_idx: int) -> None:
         self.cell_text = self.__convert_to_float(text)
+        self.table_ident = table_ident
+        self.row_idx = row_idx
+        self.col_idx = col_idx
+
+    @property
+    def cell_id(self) -> str:
+        return F"{self.table_ident}.{self.row_idx}.{self.col_idx}"
 
     def get_dict(self) -> dict:
-        return self.__dict__
+        return {
+            "cell_id": self.cell_id,
+            "cell_text": self.cell_text
+        }
 
     @staticmethod
     def __convert_to_float(text: str) -> float:
@@ -705,11 +811,13 @@ class TableCell:
 
 
 class Infons:
+    __slots__ = ("section_title_1", "iao_name_1", "iao_id_1", "infons_type")
     TYPE_TITLE = 1
     TYPE_CAPTION = 2
     TYPE_FOOTER = 3
     TYPE_SECTION = 4
     TYPE_DATA_SECTION = 5
+    __shared = {}
 
     def __init__(self, section_title: str, iao_name: str, iao_id: str, infons_type: int) -> None:
         self.section_title_1 = section_title
@@ -718,10 +826,11 @@ class Infons:
         self.infons_type = infons_type
 
     def get_dict(self) -> dict:
-        output = self.__dict__
-        if "infons_type" in output.keys():
-            del output["infons_type"]
-        return output
+        return {
+            "section_title_1": self.section_title_1,
+            "iao_name_1": self.iao_name_1,
+            "iao_id_1": self.iao_id_1
+        }
 
     @staticmethod
     def get_infons(infons_type: int) -> 'Infons':
@@ -729,6 +838,10 @@ class Infons:
         if infons_type < 1 or infons_type > 5:
             raise ValueError
 
+        # infons are never modified, so passages of the same type share one instance
+        if infons_type in Infons.__shared:
+            return Infons.__shared[infons_type]
+
         if infons_type == Infons.TYPE_TITLE:
             section_title = "table_title"
             iao_name = "document title"
@@ -750,19 +863,23 @@ class Infons:
             iao_name = "section title"
             iao_id = "IAO:0000304"
 
-        return Infons(section_title, iao_name, iao_id, infons_type)
+        Infons.__shared[infons_type] = Infons(section_title, iao_name, iao_id, infons_type)
+        return Infons.__shared[infons_type]
 
 
-def complex_handler(obj: object) -> dict:
+def parse_table_fragment(task: tuple) -> list:
     """
-    JSON default handler for dumping Table objects and nested children.
+    Process pool entry point for TableParser.parse_table with the table element serialised to HTML.
+
     Args:
-        obj: Any Table Object (Table, TablePassage etc.)
+        task: tuple of parse_table arguments, with the table as an HTML string or None if it was discarded
 
     Returns:
-        Nested dictionary object for JSON.dump structuring.
+        list of Table objects
     """
-    if hasattr(obj, 'get_dict'):
-        return obj.get_dict()
-    else:
-        raise TypeError(F'Object of type {type(obj)} with value of {repr(obj)} is not JSON serializable')
+    config, file_name, table_idx, html, title, caption, footer, max_span, max_grid_cells = task
+    if not html:
+        return []
+    table = BeautifulSoup(html, "html.parser").find()
+    return TableParser.parse_table(config, file_name, table_idx, table, title, caption, footer, max_span,
+                                   max_grid_cells)
@@ -5,8 +5,8 @@ import unicodedata
 import bs4
 import networkx as nx
 from bs4 import NavigableString, Tag
+from bs4.element import PreformattedString
 from lxml import etree
-from lxml.html.soupparser import fromstring
 
 
 def get_files(base_dir, pattern=r'(.*).html'):
@@ -155,6 +155,8 @@ def config_tags(tags):
 
 
 def parse_configs(definition):
+    if isinstance(definition, CompiledDefinition):
+        return definition.bs_attrs
     bs_attrs = {
         "name": [],
         "attrs": [],
@@ -169,6 +171,178 @@ def parse_configs(definition):
     return bs_attrs
 
 
+class CompiledDefinition(dict):
+    """
+    A single config definition (tag/attrs/xpath) with its matchers compiled once by parse_configs().
+    Behaves as the original definition dict so existing lookups such as definition["tag"] still work.
+    """
+
+    def __init__(self, definition):
+        super().__init__(definition)
+        self.bs_attrs = parse_configs(definition)
+
+
+class CompiledConfig(dict):
+    """
+    Config with every defined-by and data definition compiled once, so it can be shared across documents
+    instead of recompiling the anchored regexes on each handle_defined_by() call.
+    Accepted anywhere a config dict is (AutoCorpus, Section, TableParser, handle_not_tables etc.).
+    """
+
+    def __init__(self, config):
+        super().__init__({key: self.__compile_element(value) for key, value in config.items()})
+
+    @staticmethod
+    def __compile_definitions(definitions):
+        if not isinstance(definitions, list):
+            return definitions
+        return [CompiledDefinition(x) if isinstance(x, dict) else x for x in definitions]
+
+    @staticmethod
+    def __compile_element(element):
+        if not isinstance(element, dict):
+            return element
+        compiled = dict(element)
+        if "defined-by" in compiled:
+            compiled["defined-by"] = CompiledConfig.__compile_definitions(compiled["defined-by"])
+        if isinstance(compiled.get("data"), dict):
+            compiled["data"] = {key: CompiledConfig.__compile_definitions(value)
+                                for key, value in compiled["data"].items()}
+        return compiled
+
+
+class SoupXPathIndex:
+    """
+    lxml tree mirroring a BeautifulSoup document, built once per document so xpath config rules can be evaluated
+    without re-serialising and re-parsing the soup. Matches are mapped back to the original soup nodes.
+    """
+
+    def __init__(self, root):
+        self.__root = root
+        self.__soup_nodes = {}
+        self.__elements = {}
+        # str() of a document is its contents, while str() of a tag includes the tag itself
+        top_nodes = root.contents if isinstance(root, bs4.BeautifulSoup) else [root]
+        # mirror lxml.html.soupparser, which keeps the nodes from the first to the last top level tag, moved into the
+        # first html tag among them or wrapped in a new html element
+        tag_idx = [i for i, x in enumerate(top_nodes) if isinstance(x, Tag)]
+        roots = top_nodes[tag_idx[0]:tag_idx[-1] + 1] if tag_idx else top_nodes
+        html_idx = next((i for i, x in enumerate(roots) if isinstance(x, Tag) and x.name.lower() == "html"), None)
+        self.__merged_html = html_idx is not None and len(roots) > 1
+        if html_idx is None:
+            self.tree = etree.Element("html")
+            self.__copy_nodes(roots, self.tree)
+        else:
+            self.tree = self.__new_element(None, roots[html_idx])
+            self.__copy_nodes(roots[:html_idx] + roots[html_idx].contents + roots[html_idx + 1:], self.tree)
+
+    @classmethod
+    def for_soup(cls, soup):
+        """
+        Returns the index of the document containing soup, building it on first use.
+        """
+        root = soup
+        while root.parent is not None:
+            root = root.parent
+        # read __dict__ directly, Tag.__getattr__ would otherwise search the document for a child tag
+        index = root.__dict__.get("_xpath_index")
+        if index is None:
+            index = cls(root)
+            root.__dict__["_xpath_index"] = index
+        return index
+
+    def __new_element(self, parent, tag):
+        try:
+            element = etree.Element(tag.name) if parent is None else etree.SubElement(parent, tag.name)
+        except ValueError:
+            # tag names html.parser accepts but XML does not
+            element = etree.Element("invalid") if parent is None else etree.SubElement(parent, "invalid")
+        for key, value in tag.attrs.items():
+            try:
+                element.set(key, " ".join(value) if isinstance(value, list) else str(value))
+            except (ValueError, TypeError):
+                continue
+        self.__soup_nodes[element] = tag
+        # soup tags compare by content, so they are looked up by identity
+        self.__elements[id(tag)] = element
+        return element
+
+    def __copy_nodes(self, nodes, element):
+        stack = [(nodes, element)]
+        while stack:
+            nodes, element = stack.pop()
+            last = None
+            for child in nodes:
+                if isinstance(child, Tag):
+                    last = self.__new_element(element, child)
+                    stack.append((child.contents, last))
+                elif isinstance(child, NavigableString) and not isinstance(child, PreformattedString):
+                    if last is None:
+                        element.text = (element.text or "") + child
+                    else:
+                        last.tail = (last.tail or "") + child
+
+    @staticmethod
+    def __is_within(node, context):
+        while node is not None:
+            if node is context:
+                return True
+            node = node.parent
+        return False
+
+    def __evaluate(self, path, context):
+        # a document is not mirrored itself, its contents are
+        element = self.__elements.get(id(context), self.tree)
+        if element is self.tree:
+            return etree.ElementTree(self.tree).xpath(path)
+        # context is evaluated on its own, as lxml.html.soupparser.fromstring(str(context)) would parse it: as the
+        # root if it is an html element, otherwise as the only element within an html root
+        parent, index, tail = element.getparent(), element.getparent().index(element), element.tail
+        element.tail = None
+        if element.tag == "html":
+            parent.remove(element)
+            fragment = element
+        else:
+            fragment = etree.Element("html")
+            fragment.append(element)
+        try:
+            return etree.ElementTree(fragment).xpath(path)
+        finally:
+            parent.insert(index, element)
+            element.tail = tail
+
+    def xpath(self, path, context):
+        """
+        Evaluates path against context and returns the matching soup tags.
+
+        The mirrored element of context is moved into a tree of its own while path is evaluated, so absolute and
+        positional expressions select the same nodes as when each searched fragment was re-parsed.
+
+        Args:
+            path: xpath expression from the config
+            context: soup node being searched, matches since removed from it are ignored
+
+        Returns:
+            list of (tag, tail) tuples where tail is the NavigableString directly following the tag, or None
+        """
+        element = self.__elements.get(id(context))
+        if context is not self.__root and (element is None or element is self.tree and self.__merged_html):
+            # a tag created after the document was mirrored, or the html tag other top level nodes were moved into
+            return SoupXPathIndex(context).xpath(path, context)
+        results = []
+        for element in self.__evaluate(path, context):
+            tag = self.__soup_nodes.get(element)
+            if tag is None or not self.__is_within(tag, context):
+                continue
+            tail = tag.next_sibling
+            # text outside of the parsed fragment, such as after the last top level tag, is not part of the tree
+            if not element.tail or not isinstance(tail, NavigableString) or isinstance(tail, PreformattedString) or \
+                    tag is context:
+                tail = None
+            results.append((tag, tail))
+        return results
+
+
 def recursively_strip_strings(tag):
     """
     Remove leading and trailing whitespace & newline characters from soup tags recursively.
@@ -210,23 +384,14 @@ def handle_defined_by(config, soup):
             if new_matches:
                 new_matches = [x for x in new_matches if x.text]
         if "xpath" in bs_attrs:
-            if type(bs_attrs["xpath"]) is list:
-                for path in bs_attrs["xpath"]:
-                    xpath_matches = fromstring(str(soup)).xpath(path)
-                    if xpath_matches:
-                        for new_match in xpath_matches:
-                            new_match = bs4.BeautifulSoup(etree.tostring(new_match, encoding="unicode", method="html"),
-                                                          "html.parser")
-                            if new_match.text.strip():
-                                new_matches.extend(new_match)
-            else:
-                xpath_matches = fromstring(str(soup)).xpath(bs_attrs["xpath"])
-                if xpath_matches:
-                    for new_match in xpath_matches:
-                        new_match = bs4.BeautifulSoup(etree.tostring(new_match, encoding="unicode", method="html"),
-                                                      "html.parser")
-                        if new_match.text.strip():
-                            new_matches.extend(new_match)
+            paths = bs_attrs["xpath"] if type(bs_attrs["xpath"]) is list else [bs_attrs["xpath"]]
+            for path in paths:
+                for new_match, tail in SoupXPathIndex.for_soup(soup).xpath(path, soup):
+                    if new_match.text.strip() or (tail and tail.strip()):
+                        new_matches.append(new_match)
+                        # trailing text of a match has always been returned alongside it
+                        if tail:
+                            new_matches.append(tail)
         for match in new_matches:
             matched_text = None
             if type(match) is not NavigableString:
@@ -314,20 +479,28 @@ def get_data_element_node(config, soup):
     return handle_defined_by(config, soup)
 
 
-def navigate_contents(item):
-    value = ""
+def collect_contents(item, parts):
+    """
+    Append the NFKD normalised text of a soup node to parts, keeping sup and sub tags as markup.
+    Accumulating into one list avoids building intermediate strings for every nested node.
+    """
     if isinstance(item, bs4.element.NavigableString):
-        value += unicodedata.normalize("NFKD", item)
+        parts.append(unicodedata.normalize("NFKD", item))
     if isinstance(item, bs4.element.Tag):
         if item.name == "sup" or item.name == "sub":
-            value += "<" + item.name + ">"
+            parts.append("<" + item.name + ">")
             for childItem in item.contents:
-                value += navigate_contents(childItem)
-            value += "</" + item.name + ">"
+                collect_contents(childItem, parts)
+            parts.append("</" + item.name + ">")
         else:
             for childItem in item.contents:
-                value += navigate_contents(childItem)
-    return value
+                collect_contents(childItem, parts)
+
+
+def navigate_contents(item):
+    parts = []
+    collect_contents(item, parts)
+    return "".join(parts)
 
 
 def handle_tables(config, soup):
@@ -358,11 +531,11 @@ def handle_tables(config, soup):
                             if newMatch.get_text() in seen_text:
                                 continue
                             else:
-                                value = ""
+                                parts = []
                                 for item in newMatch.contents:
-                                    value += navigate_contents(item)
-                                    # clean the cell
-                                value = value.strip().replace('\u2009', ' ')
+                                    collect_contents(item, parts)
+                                # clean the cell
+                                value = "".join(parts).strip().replace('\u2009', ' ')
                                 value = re.sub(r"</?span[^>\n]*>?|<hr/>?", "", value)
                                 value = re.sub(r"\\n", "", value)
                                 response_addition[ele].append(value)